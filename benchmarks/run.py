@@ -0,0 +1,234 @@
+"""
+Benchmarks of the hot paths on seeded synthetic data, at several data sizes.
+
+Run from the repository root:
+
+    python -m benchmarks.run                      # every size, compared with benchmarks/baseline.json
+    python -m benchmarks.run --sizes small medium --curves curves.png
+    python -m benchmarks.run --save-baseline      # store the results as the new baseline
+    python -m benchmarks.run --check              # in CI, a missing baseline is an error too
+
+Exits with status 1 when a benchmark is slower, or uses more memory, than the baseline allows,
+and with status 2 under --check when there is no baseline to compare with.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pulp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profiling
+import fetch_data
+import clean_data
+import feature_utils
+import pipeline
+import team_opt
+import rf_compiled
+from rf_model import rf_xp_model
+from benchmarks import synthetic
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Seasons, players per season and played gameweeks of the last season
+SIZES = {
+    'small': {'n_seasons': 2, 'n_players': 200, 'n_gameweeks': 10},
+    'medium': {'n_seasons': 3, 'n_players': 400, 'n_gameweeks': 20},
+    'large': {'n_seasons': 5, 'n_players': 600, 'n_gameweeks': 30},
+}
+
+def measure(func, setup=lambda: (), repeat=3):
+    """
+    Time a function and measure its memory.
+
+    Parameters:
+    - func: function to benchmark
+    - setup: function returning the arguments of `func`, called before every run and not timed,
+        so functions that change their input get a fresh copy
+    - repeat: int, number of timed runs, the fastest is kept
+
+    Returns:
+    Dict with the wall and CPU seconds of the fastest run, and the peak memory in bytes and
+    explicit DataFrame.copy calls of one more run with profiling enabled.
+    """
+    best = None
+    for _ in range(repeat):
+        args = setup()
+        wall, cpu = time.perf_counter(), time.process_time()
+        func(*args)
+        run = (time.perf_counter() - wall, time.process_time() - cpu)
+        best = run if best is None or run[0] < best[0] else best
+
+    args = setup()
+    profiling.enable()
+    try:
+        with profiling.stage('benchmark') as record:
+            func(*args)
+    finally:
+        profiling.disable()
+        profiling.reset()
+    return {'wall_seconds': best[0], 'cpu_seconds': best[1], 'peak_bytes': record['peak_bytes'],
+            'explicit_copies': record['explicit_copies']}
+
+
+def run_size(size, config, seed=0, repeat=3, n_estimators=20):
+    """
+    Run every benchmark on synthetic data of one size.
+
+    Parameters:
+    - size: str, name of the size
+    - config: dict of make_season_data arguments
+    - seed: int, seed of the synthetic data and of the model
+    - repeat: int, timed runs of every benchmark
+    - n_estimators: int, number of trees of the benchmarked forest
+
+    Returns:
+    List of result dicts, one per benchmark.
+    """
+    results = []
+
+    def add(name, rows, func, setup=lambda: ()):
+        result = measure(func, setup, repeat)
+        results.append({'benchmark': name, 'size': size, 'rows': rows, **result})
+        print(f"{size:>8} {name:<40} {rows:>8} rows {result['wall_seconds'] * 1000:>10.1f} ms "
+              f"{(result['peak_bytes'] or 0) / 2 ** 20:>8.1f} MiB")
+
+    with tempfile.TemporaryDirectory() as data_root:
+        seasons = synthetic.write_season_data(data_root, synthetic.make_season_data(seed=seed, **config))
+        fixtures = fetch_data.get_all_fixture_df(data_root, seasons)
+        player_data = fetch_data.get_all_player_data(fixtures, data_root, seasons)
+        # Gameweek files are read from a local directory, so network speed stays out of the results
+        add('fetch_data.get_all_player_data', len(player_data), lambda: fetch_data.get_all_player_data(fixtures, data_root, seasons))
+
+    future = fetch_data.get_future_gameweeks(player_data, fixtures, 3)
+    add('fetch_data.get_future_gameweeks', len(future), lambda: fetch_data.get_future_gameweeks(player_data, fixtures, 3))
+
+    combined = pd.concat([player_data, future], ignore_index=True)
+    cleaned = clean_data.clean_player_data(combined.copy(), fixtures)
+    add('clean_data.clean_player_data', len(combined), clean_data.clean_player_data, lambda: (combined.copy(), fixtures))
+
+    feature_functions = [feature_utils.generate_difficulty_feature, feature_utils.get_avg_ppg,
+                         feature_utils.get_rolling_avg_mins, feature_utils.generate_rolling_form,
+                         feature_utils.generate_rolling_ict, feature_utils.generate_features,
+                         feature_utils.encode_positions, feature_utils.encode_teams]
+    for func in feature_functions:
+        add(f'feature_utils.{func.__name__}', len(cleaned), func, lambda: (cleaned.copy(),))
+
+    # The frame and model inputs the pipeline trains and predicts on
+    features = pipeline._features(cleaned, fixtures)
+    _, X, y, future, X_future = pipeline.model_inputs(features)
+    model = rf_xp_model(n_estimators=n_estimators, n_jobs=1, random_state=seed)
+    add('rf_xp_model.fit', len(X), lambda: model.fit(model._matrix(X), y, list(X.columns)))
+
+    add('rf_xp_model.predict', len(X_future), lambda: model.predict(X_future))
+    with tempfile.TemporaryDirectory() as forest_dir:
+        rf_compiled.export_forest(model.model, forest_dir)
+        forest = rf_compiled.compiled_forest(forest_dir)
+        X_future_matrix = X_future.to_numpy(dtype=np.float32)
+        add('rf_compiled.compiled_forest.predict', len(X_future), lambda: forest.predict(X_future_matrix))
+        del forest
+
+    predictions = future.assign(xP=model.predict(X_future))
+    next_gameweek = predictions[predictions['gameweek'] == predictions['gameweek'].min()].reset_index(drop=True)
+    add('team_opt.select_team', len(next_gameweek),
+        lambda: team_opt.select_team(next_gameweek, 1000, solver=pulp.PULP_CBC_CMD(msg=False)))
+    return results
+
+
+def compare(results, baseline, time_tolerance=0.5, memory_tolerance=0.25, min_seconds=0.01, min_bytes=2 ** 20):
+    """
+    Find the results that regressed against a baseline.
+
+    A result regresses when it is more than `time_tolerance` (as a fraction) slower, or uses
+    `memory_tolerance` more peak memory, than the baseline, and the difference is larger than
+    `min_seconds` / `min_bytes` so timer noise on fast benchmarks is ignored.
+
+    Returns:
+    List of messages describing each regression.
+    """
+    stored = {(result['benchmark'], result['size']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        base = stored.get((result['benchmark'], result['size']))
+        if base is None:
+            continue
+        wall, base_wall = result['wall_seconds'], base['wall_seconds']
+        if wall > base_wall * (1 + time_tolerance) and wall - base_wall > min_seconds:
+            regressions.append(f"{result['benchmark']} [{result['size']}]: {wall * 1000:.1f} ms, baseline {base_wall * 1000:.1f} ms")
+        peak, base_peak = result['peak_bytes'] or 0, base['peak_bytes'] or 0
+        if peak > base_peak * (1 + memory_tolerance) and peak - base_peak > min_bytes:
+            regressions.append(f"{result['benchmark']} [{result['size']}]: peak {peak / 2 ** 20:.1f} MiB, "
+                               f"baseline {base_peak / 2 ** 20:.1f} MiB")
+    return regressions
+
+
+def plot_curves(results, path):
+    """Plot the wall time and peak memory of every benchmark against the number of rows it ran on."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    df = pd.DataFrame(results)
+    fig, axes = plt.subplots(1, 2, figsize=(16, 7))
+    for benchmark, group in df.sort_values('rows').groupby('benchmark'):
+        axes[0].plot(group['rows'], group['wall_seconds'], marker='o', label=benchmark)
+        axes[1].plot(group['rows'], group['peak_bytes'] / 2 ** 20, marker='o', label=benchmark)
+    for ax, label in zip(axes, ['wall seconds', 'peak MiB']):
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('rows')
+        ax.set_ylabel(label)
+    axes[1].legend(fontsize='small', loc='center left', bbox_to_anchor=(1, 0.5))
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths on synthetic data.')
+    parser.add_argument('--sizes', nargs='+', default=list(SIZES), choices=list(SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--trees', type=int, default=20, help='number of trees of the benchmarked forest')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--check', action='store_true', help='fail when there is no baseline to compare with')
+    parser.add_argument('--time-tolerance', type=float, default=0.5)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--curves', help='image file to plot the scaling curves to')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, SIZES[size], args.seed, args.repeat, args.trees))
+    report = {'seed': args.seed, 'trees': args.trees, 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.curves:
+        plot_curves(results, args.curves)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --save-baseline to store one')
+        return 2 if args.check else 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.time_tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+TEAM_NAMES = ['Arsenal', 'Aston Villa', 'Bournemouth', 'Brentford', 'Brighton', 'Burnley', 'Chelsea', 'Crystal Palace',
+              'Everton', 'Fulham', 'Liverpool', 'Luton', 'Man City', 'Man Utd', 'Newcastle', "Nott'm Forest",
+              'Sheffield Utd', 'Spurs', 'West Ham', 'Wolves', 'Leeds', 'Leicester', 'Norwich', 'Watford',
+              'Southampton', 'West Brom']
+FIRST_NAMES = ['Aaron', 'Ben', 'Callum', 'Danny', 'Eddie', 'Fabio', 'Gabriel', 'Harry', 'Ivan', 'Jack', 'Kai', 'Leon',
+               'Mason', 'Nathan', 'Ollie', 'Pedro', 'Reece', 'Sam', 'Tom', 'Will']
+LAST_NAMES = ['Smith', 'Jones', 'Taylor', 'Brown', 'Wilson', 'Johnson', 'White', 'Martin', 'Walker', 'Wood', 'Hughes',
+              'Green', 'Hall', 'Lewis', 'Clarke', 'Robinson', 'Wright', 'Thompson', 'Evans', 'Edwards', 'Silva',
+              'Santos', 'Costa', 'Moore', 'King']
+N_TEAMS = 20
+N_EVENTS = 38
+
+# Columns missing from the 2019-20 gameweek files, whose names are also stored as First_Last_element
+COLUMNS_MISSING_2019 = ['position', 'team', 'xP', 'expected_assists', 'expected_goal_involvements', 'expected_goals',
+                        'expected_goals_conceded', 'starts']
+
+
+def season_names(n_seasons, last_season='2023-24'):
+    """Names of `n_seasons` consecutive seasons ending with `last_season`."""
+    last = int(last_season[:4])
+    return [f'{year}-{(year + 1) % 100:02d}' for year in range(last - n_seasons + 1, last + 1)]
+
+
+def player_names(n_players, rng):
+    """Shuffled unique player names, numbered once the first and last name pairs run out."""
+    base = [f'{first} {last}' for first in FIRST_NAMES for last in LAST_NAMES]
+    names = np.array([name if k == 1 else f'{name} {k}' for k in range(1, n_players // len(base) + 2) for name in base][:n_players])
+    rng.shuffle(names)
+    return names
+
+
+def make_teams(rng):
+    names = rng.choice(TEAM_NAMES, N_TEAMS, replace=False)
+    return pd.DataFrame({'id': np.arange(1, N_TEAMS + 1), 'name': names, 'code': rng.choice(100, N_TEAMS, replace=False) + 1,
+                         'short_name': [name[:3].upper() for name in names]})
+
+
+def make_fixtures(season, n_played, rng, now=None):
+    """
+    Fixture table of a season, every team playing once per gameweek.
+
+    Parameters:
+    - season: str, season name such as '2023-24'
+    - n_played: int, number of gameweeks already played, later fixtures have no score and kick off after `now`
+    - rng: numpy random Generator
+    - now: pandas Timestamp the unplayed fixtures are scheduled after, defaults to the current time
+    """
+    now = now or pd.Timestamp.now(tz='UTC').floor('D')
+    events = np.repeat(np.arange(1, N_EVENTS + 1), N_TEAMS // 2)
+    pairs = np.argsort(rng.random((N_EVENTS, N_TEAMS)), axis=1).reshape(-1, 2) + 1
+    played = events <= n_played
+    kickoff = np.where(played, pd.Timestamp(f'{season[:4]}-08-10', tz='UTC') + pd.to_timedelta(7 * (events - 1), unit='D'),
+                       now + pd.to_timedelta(7 * (events - n_played), unit='D'))
+    scores = rng.integers(0, 4, size=(len(events), 2)).astype(float)
+    scores[~played] = np.nan
+    return pd.DataFrame({
+        'id': np.arange(1, len(events) + 1), 'event': events, 'team_h': pairs[:, 0], 'team_a': pairs[:, 1],
+        'team_h_difficulty': rng.integers(2, 6, len(events)), 'team_a_difficulty': rng.integers(2, 6, len(events)),
+        'team_h_score': scores[:, 0], 'team_a_score': scores[:, 1],
+        'kickoff_time': pd.DatetimeIndex(kickoff).strftime('%Y-%m-%dT%H:%M:%SZ'), 'finished': played,
+    })
+
+
+def make_gameweek(season, gameweek, names, positions, player_teams, teams, fixtures, rng):
+    """Gameweek file of a season, with the columns of the vaastav/Fantasy-Premier-League gws/gw{n}.csv files."""
+    event = fixtures[fixtures['event'] == gameweek]
+    # Fixture of every team in the gameweek, as seen from that team
+    home = pd.Series(True, index=event['team_h'].to_numpy())
+    opponent = pd.concat([pd.Series(event['team_a'].to_numpy(), index=event['team_h'].to_numpy()),
+                          pd.Series(event['team_h'].to_numpy(), index=event['team_a'].to_numpy())]).sort_index()
+    fixture = pd.concat([pd.Series(event['id'].to_numpy(), index=event['team_h'].to_numpy()),
+                         pd.Series(event['id'].to_numpy(), index=event['team_a'].to_numpy())]).sort_index()
+    match = event.set_index('id')
+
+    # Some players miss every gameweek file, such as injured or unregistered players
+    present = np.flatnonzero(rng.random(len(names)) >= 0.1)
+    n = len(present)
+    team = player_teams[present]
+    minutes = rng.choice([0, 0, 15, 60, 90, 90, 90], n)
+    df = pd.DataFrame({
+        'name': names[present], 'position': positions[present], 'team': teams.set_index('id').loc[team, 'name'].to_numpy(),
+        'xP': np.round(rng.random(n) * 6, 1), 'assists': (rng.random(n) < 0.1).astype(int),
+        'bonus': rng.integers(0, 4, n), 'bps': rng.integers(0, 40, n), 'clean_sheets': (rng.random(n) < 0.3).astype(int),
+        'creativity': np.round(rng.random(n) * 50, 1), 'element': present + 1,
+        'expected_assists': np.round(rng.random(n), 2), 'expected_goal_involvements': np.round(rng.random(n), 2),
+        'expected_goals': np.round(rng.random(n), 2), 'expected_goals_conceded': np.round(rng.random(n) * 2, 2),
+        'fixture': fixture.loc[team].to_numpy(), 'goals_conceded': rng.integers(0, 4, n),
+        'goals_scored': (rng.random(n) < 0.1).astype(int), 'ict_index': np.round(rng.random(n) * 15, 1),
+        'influence': np.round(rng.random(n) * 60, 1), 'kickoff_time': match.loc[fixture.loc[team], 'kickoff_time'].to_numpy(),
+        'minutes': minutes, 'opponent_team': opponent.loc[team].to_numpy(), 'own_goals': 0, 'penalties_missed': 0,
+        'penalties_saved': 0, 'red_cards': 0, 'round': gameweek, 'saves': rng.integers(0, 5, n),
+        'selected': rng.integers(0, 1_000_000, n), 'starts': (minutes > 0).astype(int),
+        'team_a_score': match.loc[fixture.loc[team], 'team_a_score'].to_numpy(),
+        'team_h_score': match.loc[fixture.loc[team], 'team_h_score'].to_numpy(),
+        'threat': np.round(rng.random(n) * 40, 1),
+        'total_points': np.where(minutes > 0, rng.integers(-1, 15, n), 0),
+        'transfers_balance': rng.integers(-1000, 1000, n), 'transfers_in': rng.integers(0, 1000, n),
+        'transfers_out': rng.integers(0, 1000, n), 'value': rng.integers(40, 130, n),
+        'was_home': home.reindex(team, fill_value=False).to_numpy(), 'yellow_cards': (rng.random(n) < 0.1).astype(int),
+    })
+    if season == '2019-20':
+        df = df.drop(columns=COLUMNS_MISSING_2019)
+        df['name'] = [f"{name.replace(' ', '_')}_{element}" for name, element in zip(df['name'], df['element'])]
+    return df
+
+
+def make_season_data(n_seasons=5, n_players=500, n_gameweeks=20, seed=0, now=None):
+    """
+    Seeded synthetic FPL data with the schemas of the vaastav/Fantasy-Premier-League data folder.
+
+    Earlier seasons are complete and the last season has `n_gameweeks` played gameweeks. Players
+    keep their name across seasons apart from a few renames every other season, and 2019-20 and
+    2020-21 keep the quirks of the real files (missing columns and First_Last_element names, and
+    'GKP' goalkeepers), so the cleaning steps have the same work to do as on real data.
+
+    Parameters:
+    - n_seasons: int, number of seasons, ending with 2023-24
+    - n_players: int, number of players per season
+    - n_gameweeks: int, played gameweeks of the last season
+    - seed: int, seed of every random draw
+    - now: pandas Timestamp the unplayed fixtures are scheduled after, defaults to the current time
+
+    Returns:
+    Dict of {path relative to the data root: DataFrame}.
+    """
+    rng = np.random.default_rng(seed)
+    names = player_names(n_players, rng)
+    positions = rng.choice(['GK', 'DEF', 'MID', 'FWD'], n_players, p=[0.1, 0.35, 0.35, 0.2])
+    player_teams = np.arange(n_players) % N_TEAMS + 1
+    seasons = season_names(n_seasons)
+    files = {}
+    for k, season in enumerate(seasons):
+        played = n_gameweeks if season == seasons[-1] else N_EVENTS
+        teams = make_teams(rng)
+        fixtures = make_fixtures(season, played, rng, now)
+        season_players = np.where((np.arange(n_players) % 37 == 0) & (k % 2 == 1), np.char.add(names, 'o'), names)
+        season_positions = np.where((positions == 'GK') & (season == '2020-21'), 'GKP', positions)
+        files[f'{season}/teams.csv'] = teams
+        files[f'{season}/fixtures.csv'] = fixtures
+        for gameweek in range(1, played + 1):
+            files[f'{season}/gws/gw{gameweek}.csv'] = make_gameweek(season, gameweek, season_players, season_positions,
+                                                                    player_teams, teams, fixtures, rng)
+    return files
+
+
+def write_season_data(data_root, files):
+    """Write the tables of make_season_data as a local data root that fetch_data can read."""
+    for path, df in files.items():
+        os.makedirs(os.path.dirname(os.path.join(data_root, path)), exist_ok=True)
+        df.to_csv(os.path.join(data_root, path), index=False)
+    return sorted({path.split('/')[0] for path in files})
@@ -0,0 +1,127 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_session(pool_size=16, retries=0, backoff_factor=0.5):
+    """
+    Create a requests session whose connection pool can serve `pool_size` concurrent requests.
+
+    Parameters:
+    - pool_size: int, number of pooled connections per host
+    - retries: int, times to retry failed connections, 429 and 5xx responses, with exponential backoff
+    - backoff_factor: float, seconds to wait before the first retry, doubled for every later one
+    """
+    session = requests.Session()
+    max_retries = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504],
+                        allowed_methods=['GET']) if retries else 0
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=max_retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class csv_loader():
+    def __init__(self, data_root, max_workers=16, timeout=30, ttl=None):
+        """
+        Loads csv files relative to a data root concurrently.
+
+        Parameters:
+        - data_root: str, base url (http/https) or local directory
+        - max_workers: int, size of the thread pool and of the connection pool
+        - timeout: float, per request timeout in seconds
+        - ttl: float, seconds a remembered frame is reused before it is fetched again, forever when None
+        """
+        self.data_root = data_root.rstrip('/')
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ttl = ttl
+        self.is_remote = '://' in data_root
+        self.session = make_session(max_workers) if self.is_remote else None
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _read(self, path):
+        """Fetch and parse one file, returning None if it does not exist."""
+        location = f'{self.data_root}/{path}'
+        if not self.is_remote:
+            if not os.path.exists(location):
+                return None
+            return pd.read_csv(location)
+        response = self.session.get(location, timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return pd.read_csv(io.BytesIO(response.content))
+
+    def _stat(self, path):
+        """Size and modification time of one file (ETag and headers when remote), None if it does not exist."""
+        location = f'{self.data_root}/{path}'
+        if not self.is_remote:
+            if not os.path.exists(location):
+                return None
+            stat = os.stat(location)
+            return [stat.st_size, stat.st_mtime_ns]
+        response = self.session.head(location, timeout=self.timeout, allow_redirects=True)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return [response.headers.get(name) for name in ['ETag', 'Last-Modified', 'Content-Length']]
+
+    def fingerprint(self, paths):
+        """
+        Cheap identity of a batch of files without downloading them: their sizes and modification
+        times, or for a remote data root the ETag and headers of a HEAD request, fetched concurrently.
+
+        Returns:
+        Dict mapping each path to its identity, or None if the file does not exist.
+        """
+        paths = list(dict.fromkeys(paths))
+        if not paths:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(paths))) as executor:
+            return dict(zip(paths, executor.map(self._stat, paths)))
+
+    def load_many(self, paths, keep=True):
+        """
+        Load a batch of files concurrently.
+
+        Repeated paths, and paths kept by an earlier call less than `ttl` seconds ago, are only fetched once.
+
+        Parameters:
+        - paths: list of paths relative to the data root
+        - keep: bool, whether to remember the parsed frames for later calls
+
+        Returns:
+        Dict mapping each path to its DataFrame, or None if the file does not exist.
+        """
+        now = time.monotonic()
+        with self._lock:
+            frames = {path: self._frames[path][0] for path in paths
+                      if path in self._frames and (self.ttl is None or now - self._frames[path][1] < self.ttl)}
+        todo = [path for path in dict.fromkeys(paths) if path not in frames]
+        if todo:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(todo))) as executor:
+                futures = {executor.submit(self._read, path): path for path in todo}
+                for future in as_completed(futures):
+                    frames[futures[future]] = future.result()
+            if keep:
+                with self._lock:
+                    self._frames.update((path, (frames[path], now)) for path in todo)
+        return frames
+
+    def load(self, path, keep=True):
+        """Load a single file, see `load_many`."""
+        return self.load_many([path], keep=keep)[path]
+
+    def clear(self):
+        """Forget every remembered frame."""
+        with self._lock:
+            self._frames.clear()
@@ -0,0 +1,188 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+import fetch_data
+
+# Feature frame columns that are not model inputs: identifiers, the target and every stat of the game
+#  itself, which is only known after kickoff and missing from the rows to predict
+DROP_COLUMNS = ['name', 'kickoff_time', 'season', 'total_points', 'is_future'] + fetch_data.MATCH_STAT_COLUMNS
+SCHEMA_FILE = 'schema.json'
+
+
+def _time_keys(season_codes, gameweeks):
+    """Sortable key combining season and gameweek."""
+    return season_codes.astype(np.int64) * 100 + gameweeks
+
+
+def _as_rows(positions):
+    """Sorted row positions as a slice when they are contiguous, so indexing the arrays gives a view rather than a copy."""
+    if len(positions) == 0:
+        return slice(0, 0)
+    if positions[-1] - positions[0] + 1 == len(positions):
+        return slice(int(positions[0]), int(positions[-1]) + 1)
+    return positions
+
+
+def row_count(rows):
+    """Number of rows selected by a slice or an array of row positions."""
+    return rows.stop - rows.start if isinstance(rows, slice) else len(rows)
+
+
+def write_feature_matrix(df, path, target='total_points', drop_columns=DROP_COLUMNS, labelled=None):
+    """
+    Write the model inputs of a feature frame to `path` as memory-mappable float32 arrays.
+
+    Rows are stored in (season, gameweek) order so any time based split is a contiguous block
+    of rows. Alongside the feature matrix `X.npy` and target `y.npy` the directory holds the
+    column schema, a row index mapping every row back to its player, season and gameweek and the
+    mask `labelled.npy` of the rows whose target is known.
+
+    Parameters:
+    - df: feature DataFrame with `name`, `season` and `gameweek` columns
+    - path: str, directory to write to
+    - target: str, target column
+    - drop_columns: list of columns that are not model inputs
+    - labelled: boolean array, in the row order of `df`, marking rows whose target is known. Defaults to rows with a target,
+        pass it explicitly once feature_utils has filled the missing targets of future rows with 0.
+
+    Returns:
+    feature_matrix opened on the written files.
+    """
+    columns = [col for col in df.columns if col not in drop_columns and col != target]
+    non_numeric = [col for col in columns if not (pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_bool_dtype(df[col]))]
+    if non_numeric:
+        raise ValueError(f'Columns {non_numeric} are not numeric, encode or drop them before writing the feature matrix.')
+
+    names, name_codes = np.unique(df['name'].astype(str).to_numpy(), return_inverse=True)
+    seasons, season_codes = np.unique(df['season'].astype(str).to_numpy(), return_inverse=True)
+    gameweeks = df['gameweek'].to_numpy(dtype=np.int64)
+    order = np.argsort(_time_keys(season_codes, gameweeks), kind='stable')
+
+    os.makedirs(path, exist_ok=True)
+    X = np.lib.format.open_memmap(os.path.join(path, 'X.npy'), mode='w+', dtype=np.float32, shape=(len(df), len(columns)))
+    for j, col in enumerate(columns):
+        X[:, j] = np.asarray(df[col], dtype=np.float32)[order]
+    X.flush()
+    del X
+
+    y = df[target].to_numpy(dtype=np.float32)[order] if target in df.columns else np.full(len(df), np.nan, dtype=np.float32)
+    np.save(os.path.join(path, 'y.npy'), y)
+    index = np.empty(len(df), dtype=[('name', np.int32), ('season', np.int16), ('gameweek', np.int16)])
+    index['name'] = name_codes[order]
+    index['season'] = season_codes[order]
+    index['gameweek'] = gameweeks[order]
+    np.save(os.path.join(path, 'index.npy'), index)
+
+    labelled = df[target].notna() if labelled is None else labelled
+    labelled = np.asarray(labelled, dtype=bool)[order]
+    np.save(os.path.join(path, 'labelled.npy'), labelled)
+    with open(os.path.join(path, SCHEMA_FILE), 'w') as f:
+        json.dump({
+            'columns': columns,
+            'dtypes': {col: str(df[col].dtype) for col in columns},
+            'target': target,
+            'names': names.tolist(),
+            'seasons': seasons.tolist(),
+            'n_labelled': int(labelled.sum()),
+        }, f)
+    return feature_matrix(path)
+
+
+class feature_matrix():
+    def __init__(self, path, mmap_mode='r'):
+        """
+        Feature matrix written by write_feature_matrix, memory-mapped so every process reading it
+        shares one on-disk copy.
+
+        Parameters:
+        - path: str, directory the matrix was written to
+        - mmap_mode: str, numpy memmap mode, None loads the arrays into memory
+        """
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE)) as f:
+            self.schema = json.load(f)
+        self.columns = self.schema['columns']
+        self.X = np.load(os.path.join(path, 'X.npy'), mmap_mode=mmap_mode)
+        self.y = np.load(os.path.join(path, 'y.npy'), mmap_mode=mmap_mode)
+        self.index = np.load(os.path.join(path, 'index.npy'), mmap_mode=mmap_mode)
+        self._time_keys = _time_keys(self.index['season'], self.index['gameweek'].astype(np.int64))
+        labelled_file = os.path.join(path, 'labelled.npy')
+        # Matrices written before the mask was stored have their labelled rows first
+        self._labelled = (np.flatnonzero(np.load(labelled_file)) if os.path.exists(labelled_file)
+                          else np.arange(self.schema['n_labelled']))
+
+    def __len__(self):
+        return len(self.y)
+
+    @property
+    def labelled(self):
+        """
+        Rows that have a known target, i.e. every gameweek played so far: a slice when they are
+        contiguous, otherwise an array of row positions.
+        """
+        return _as_rows(self._labelled)
+
+    def _position(self, season, gameweek, side):
+        season_code = self.schema['seasons'].index(season)
+        return int(np.searchsorted(self._time_keys, season_code * 100 + gameweek, side=side))
+
+    def before(self, season, gameweek):
+        """Slice of the rows played before `gameweek` of `season`."""
+        return slice(0, self._position(season, gameweek, 'left'))
+
+    def gameweek(self, season, gameweek):
+        """Slice of the rows of one gameweek."""
+        return slice(self._position(season, gameweek, 'left'), self._position(season, gameweek, 'right'))
+
+    def holdout(self, valid_fraction=0.2):
+        """
+        Split the labelled rows into earlier training rows and the latest `valid_fraction` as validation rows.
+
+        Returns:
+        Pair of row selections, slices when the rows are contiguous and arrays of row positions otherwise.
+        """
+        n = len(self._labelled)
+        split = n - int(round(n * valid_fraction))
+        return _as_rows(self._labelled[:split]), _as_rows(self._labelled[split:])
+
+    def walk_forward(self, n_folds=4, min_train_fraction=0.5):
+        """
+        Time ordered train/validation splits over the labelled rows.
+
+        The labelled gameweeks after the first `min_train_fraction` of rows are cut into `n_folds`
+        consecutive blocks. Each fold trains on every row before its block and validates on the block,
+        so a model is never validated on gameweeks older than the ones it was trained on.
+
+        Returns:
+        List of (train rows, validation rows) pairs, slices when the rows are contiguous and arrays
+        of row positions otherwise.
+        """
+        labelled = self._labelled
+        n = len(labelled)
+        # Fold boundaries fall on gameweek boundaries so a gameweek is never split across folds
+        gameweek_starts = np.append(np.flatnonzero(np.diff(self._time_keys[labelled], prepend=-1)), n)
+        cuts = np.linspace(n * min_train_fraction, n, n_folds + 1)
+        bounds = [int(gameweek_starts[np.searchsorted(gameweek_starts, cut)]) for cut in cuts]
+        return [(_as_rows(labelled[:start]), _as_rows(labelled[start:end]))
+                for start, end in zip(bounds[:-1], bounds[1:]) if 0 < start < end]
+
+    def row_index(self, rows=slice(None)):
+        """
+        DataFrame mapping rows back to player name, season and gameweek.
+
+        Parameters:
+        - rows: slice or array of row positions
+        """
+        index = self.index[rows]
+        return pd.DataFrame({
+            'name': np.asarray(self.schema['names'], dtype=object)[index['name']],
+            'season': np.asarray(self.schema['seasons'], dtype=object)[index['season']],
+            'gameweek': index['gameweek'],
+        })
+
+    def frame(self, rows=slice(None)):
+        """Rows as a DataFrame with the original column names, for inspection."""
+        return pd.DataFrame(self.X[rows], columns=self.columns)
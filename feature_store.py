@@ -0,0 +1,230 @@
+from collections import deque
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import feature_utils
+from feature_utils import FEATURE_SPEC
+
+
+def _window_mean(values, window):
+    """Mean of the last `window` values ignoring NaN, NaN if there are none."""
+    recent = [value for value in list(values)[-window:] if not np.isnan(value)]
+    return sum(recent) / len(recent) if recent else np.nan
+
+
+class feature_store():
+    def __init__(self, spec=FEATURE_SPEC):
+        """
+        Keeps the trailing per-player state the rolling features need so a new gameweek only
+        costs as much as the number of rows in it.
+
+        Features produced for new rows match feature_utils.generate_features over the full
+        history. avg_points_against_difficulty is an average over every gameweek a player has
+        played, so it is only brought up to date for the rows passed to `update`.
+
+        Parameters:
+        - spec: dict, feature spec as taken by feature_utils.generate_features
+        """
+        self.spec = {**FEATURE_SPEC, **spec}
+        self.players = {}
+        self.difficulty_sums = {}
+
+    def _new_player(self):
+        return {
+            'points': deque(maxlen=max(self.spec['form_windows'], default=0)),
+            'minutes': deque(maxlen=max(self.spec['minutes_windows'], default=0)),
+            'season': None,
+            'season_points': 0.0,
+            'ict': {col: deque(maxlen=self.spec['ict_window']) for col in self.spec['ict_features']},
+        }
+
+    @classmethod
+    def from_history(cls, df, spec=FEATURE_SPEC):
+        """
+        Build the store from the full history of player data.
+
+        Parameters:
+        - df: player DataFrame with every gameweek played so far
+        - spec: dict, feature spec as taken by feature_utils.generate_features
+        """
+        store = cls(spec)
+        spec = store.spec
+        df = df.sort_values(by=['name', 'season', 'gameweek']).reset_index(drop=True)
+
+        categories = feature_utils._difficulty_categories(df['difficulty'])
+        grouped = df['total_points'].groupby([df['name'], categories], observed=True)
+        store.difficulty_sums = {key: [total, count] for key, total, count in
+                                 zip(grouped.sum().index, grouped.sum().to_numpy(), grouped.count().to_numpy())}
+
+        latest_season = df['season'] == df.groupby('name')['season'].transform('last')
+        season_points = df.loc[latest_season, 'total_points'].fillna(0).groupby(df.loc[latest_season, 'name'], observed=True).sum()
+        tail_length = max(spec['form_windows'] + spec['minutes_windows'], default=0)
+        history_tail = df.groupby('name').tail(tail_length)
+        ict_tail = df[latest_season].groupby('name').tail(spec['ict_window'])
+
+        for name, rows in history_tail.groupby('name', sort=False, observed=True):
+            state = store._new_player()
+            state['points'].extend(rows['total_points'].to_numpy(dtype=float))
+            state['minutes'].extend(rows['minutes'].to_numpy(dtype=float))
+            state['season'] = rows['season'].iloc[-1]
+            state['season_points'] = float(season_points[name])
+            store.players[name] = state
+        for name, rows in ict_tail.groupby('name', sort=False, observed=True):
+            for col in spec['ict_features']:
+                store.players[name]['ict'][col].extend(rows[col].to_numpy(dtype=float))
+        return store
+
+    def feature_columns(self):
+        """Names of the features computed row by row, in the order `_features` produces them."""
+        columns = [f'avg_points_last_{window}' for window in self.spec['form_windows']]
+        columns += [f'avg_minutes_last_{window}' for window in self.spec['minutes_windows']]
+        columns += [col + f'_avg_last_{self.spec["ict_window"]}_games' for col in self.spec['ict_features']]
+        return columns + (['avg_points_upto_gw'] if self.spec['ppg'] else [])
+
+    def _features(self, state, row):
+        """Features for one row from the state of everything before it, then advance the state."""
+        features = {}
+        for window in self.spec['form_windows']:
+            features[f'avg_points_last_{window}'] = _window_mean(state['points'], window)
+        for window in self.spec['minutes_windows']:
+            features[f'avg_minutes_last_{window}'] = _window_mean(state['minutes'], window)
+        if row['season'] != state['season']:
+            state['season'] = row['season']
+            state['season_points'] = 0.0
+            for values in state['ict'].values():
+                values.clear()
+        for col in self.spec['ict_features']:
+            features[col + f'_avg_last_{self.spec["ict_window"]}_games'] = _window_mean(state['ict'][col], self.spec['ict_window'])
+
+        total_points = float(row['total_points'])
+        filled_points = 0.0 if np.isnan(total_points) else total_points
+        if self.spec['ppg']:
+            gameweek = row['gameweek']
+            features['avg_points_upto_gw'] = state['season_points'] / (gameweek - 1) if gameweek > 1 else filled_points
+
+        state['points'].append(total_points)
+        state['minutes'].append(float(row['minutes']))
+        state['season_points'] += filled_points
+        for col in self.spec['ict_features']:
+            state['ict'][col].append(float(row[col]))
+        return features
+
+    def _transform(self, df, commit):
+        df = df.sort_values(by=['name', 'season', 'gameweek']).reset_index(drop=True)
+        difficulty_sums = self.difficulty_sums if commit else dict(self.difficulty_sums)
+        players = self.players if commit else {}
+
+        if self.spec['difficulty']:
+            df['difficulty_category'] = feature_utils._difficulty_categories(df['difficulty'])
+            grouped = df['total_points'].groupby([df['name'], df['difficulty_category']], observed=True)
+            for key, total, count in zip(grouped.sum().index, grouped.sum().to_numpy(), grouped.count().to_numpy()):
+                previous = difficulty_sums.get(key, [0.0, 0])
+                difficulty_sums[key] = [previous[0] + total, previous[1] + count]
+            sums = np.array([difficulty_sums[key] for key in zip(df['name'], df['difficulty_category'])], dtype=float).reshape(-1, 2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                df['avg_points_against_difficulty'] = np.where(sums[:, 1] > 0, sums[:, 0] / sums[:, 1], np.nan)
+
+        rows = df[['name', 'season', 'gameweek', 'total_points', 'minutes'] + self.spec['ict_features']].to_dict('records')
+        features = []
+        for row in rows:
+            if row['name'] not in players:
+                if commit or row['name'] not in self.players:
+                    players[row['name']] = self._new_player()
+                else:
+                    players[row['name']] = _copy_state(self.players[row['name']])
+            features.append(self._features(players[row['name']], row))
+
+        # Explicit columns so an empty frame still comes back with every feature
+        features = pd.DataFrame(features, index=df.index, columns=self.feature_columns())
+        avg_ppg = features.pop('avg_points_upto_gw') if self.spec['ppg'] else None
+        df = pd.concat([df, features], axis=1)
+        if self.spec['fillna'] is not None:
+            feature_utils._fillna(df, self.spec['fillna'])
+        if avg_ppg is not None:
+            df['avg_points_upto_gw'] = avg_ppg
+        return df
+
+    def update(self, df):
+        """
+        Generate features for a newly played gameweek and add it to the state.
+
+        Parameters:
+        - df: player DataFrame with the rows of the new gameweek
+
+        Returns:
+        DataFrame of the new rows with their features.
+        """
+        return self._transform(df, commit=True)
+
+    def transform(self, df):
+        """
+        Generate features for rows that have not been played yet, such as the frames from
+        fetch_data.get_future_gameweeks, without changing the state.
+
+        Parameters:
+        - df: player DataFrame with future rows, in gameweek order
+
+        Returns:
+        DataFrame of the rows with their features.
+        """
+        return self._transform(df, commit=False)
+
+    def save(self, file_name):
+        """
+        Saves the store to a file.
+
+        Parameters:
+        - file_name: str, path to save the store
+        """
+        joblib.dump(self, file_name)
+
+    @staticmethod
+    def load(file_name):
+        """
+        Loads a store from a file.
+
+        Parameters:
+        - file_name: str, path to load the store from
+        """
+        return joblib.load(file_name)
+
+
+def _copy_state(state):
+    return {
+        'points': deque(state['points'], maxlen=state['points'].maxlen),
+        'minutes': deque(state['minutes'], maxlen=state['minutes'].maxlen),
+        'season': state['season'],
+        'season_points': state['season_points'],
+        'ict': {col: deque(values, maxlen=values.maxlen) for col, values in state['ict'].items()},
+    }
+
+
+def compare_with_full_recompute(history, new_rows, future_rows=None, spec=FEATURE_SPEC):
+    """
+    Check that incremental features match feature_utils.generate_features over the whole data.
+
+    Parameters:
+    - history: player DataFrame the store is built from
+    - new_rows: player DataFrame of the gameweek that is added with `update`
+    - future_rows: optional DataFrame of unplayed rows passed to `transform`
+
+    Returns:
+    Dict with the largest absolute difference of every feature column.
+    """
+    store = feature_store.from_history(history, spec)
+    incremental = [store.update(new_rows)]
+    if future_rows is not None:
+        incremental.append(store.transform(future_rows))
+    incremental = pd.concat(incremental, ignore_index=True)
+
+    parts = [history.assign(_part=0), new_rows.assign(_part=1)]
+    if future_rows is not None:
+        parts.append(future_rows.assign(_part=2))
+    full = feature_utils.generate_features(pd.concat(parts, ignore_index=True), spec)
+    full = full[full['_part'] > 0].sort_values(['_part', 'name', 'season', 'gameweek'], kind='stable')
+
+    feature_columns = [col for col in incremental.columns if col not in history.columns and col != 'difficulty_category']
+    return {col: float(np.nanmax(np.abs(full[col].to_numpy(dtype=float) - incremental[col].to_numpy(dtype=float)), initial=0.0))
+            for col in feature_columns}
@@ -2,6 +2,9 @@ import pandas as pd
 from sklearn.feature_extraction.text import CountVectorizer
 import numpy as np
 
+import schema
+import profiling
+
 def categorize_difficulty(difficulty):
     """Categorize the difficulty level of a match based on the given difficulty rating."""
     if difficulty in [1, 2]:
@@ -11,63 +14,203 @@ def categorize_difficulty(difficulty):
     else:
         return 'High Difficulty'
 
+def _difficulty_categories(difficulty):
+    """Vectorized categorize_difficulty."""
+    return np.select([difficulty.isin([1, 2]), difficulty == 3], ['Low Difficulty', 'Medium Difficulty'], 'High Difficulty')
+
+
+def _group_starts(df, keys):
+    """Position of the first row of each row's group, for a frame sorted by `keys`."""
+    n = len(df)
+    new_group = np.zeros(n, dtype=bool)
+    new_group[:1] = True
+    for key in keys:
+        column = df[key]
+        values = column.cat.codes.to_numpy() if isinstance(column.dtype, pd.CategoricalDtype) else column.to_numpy()
+        new_group[1:] |= values[1:] != values[:-1]
+    return np.maximum.accumulate(np.where(new_group, np.arange(n), 0))
+
+
+def _lagged_window_mean(values, starts, window):
+    """
+    Mean of the `window` rows before each row within its group, ignoring NaN.
+
+    Equivalent to `x.shift(1).rolling(window=window, min_periods=1).mean()` per group, computed
+    for all groups at once as the difference of two cumulative sums.
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(valid, values, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+    rows = np.arange(len(values))
+    lower = np.maximum(rows - window, starts)
+    total = sums[rows] - sums[lower]
+    count = counts[rows] - counts[lower]
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def _fillna(df, value):
+    """Fill missing values in place, leaving categorical columns alone since `value` is not one of their categories."""
+    df.fillna({col: value for col in df.columns if not isinstance(df[col].dtype, pd.CategoricalDtype)}, inplace=True)
+
+
+def _add_difficulty_feature(df):
+    df['difficulty_category'] = _difficulty_categories(df['difficulty'])
+    df['avg_points_against_difficulty'] = df.groupby(['name', 'difficulty_category'], observed=True)['total_points'].transform('mean')
+    return df
+
+
+def _add_avg_ppg(df):
+    total_points_upto_gw = df.groupby(['name', 'season'], observed=True)['total_points'].cumsum() - df['total_points']
+    df['avg_points_upto_gw'] = np.where(df['gameweek'] > 1, total_points_upto_gw / (df['gameweek'] - 1), df['total_points'])
+    return df
+
+
+@profiling.profiled
 def generate_difficulty_feature(df):
     """Generate a feature representing a player's average points against opponents of similar difficulty levels."""
-    df['difficulty_category'] = df['difficulty'].apply(categorize_difficulty)
-    df = df.sort_values(by=['name', 'season', 'gameweek'])
-    avg_against_diff = df.groupby(['name', 'difficulty_category'])['total_points'].mean().reset_index(name='avg_points_against_difficulty')
-    return pd.merge(df, avg_against_diff, on=['name', 'difficulty_category'], how='left')
+    df = df.sort_values(by=['name', 'season', 'gameweek']).reset_index(drop=True)
+    return _add_difficulty_feature(df)
 
 
+@profiling.profiled
 def get_avg_ppg(df):
     """Generate a feature showcasing player average point per game for the season upto current gameweek"""
-    df['total_points_upto_gw'] = df.groupby(['name', 'season'])['total_points'].apply(pd.Series.cumsum).reset_index(drop=True)
-    df['total_points_upto_gw'] = df['total_points_upto_gw'] - df['total_points']
-    df['avg_points_upto_gw'] = df.apply(lambda row: row['total_points_upto_gw'] / (row['gameweek'] - 1) 
-                                        if row['gameweek'] > 1 else row['total_points'], axis=1)
-    df.drop(columns=['total_points_upto_gw'], inplace=True)
-    return df
+    return _add_avg_ppg(df)
 
+@profiling.profiled
 def get_rolling_avg_mins(df, windows=[1, 2, 3, 4, 5]):
     """Generate avg minutes in previous x games feature"""
     df = df.sort_values(by=['name', 'season', 'gameweek'])
+    starts = _group_starts(df, ['name'])
     for window in windows:
-        df[f'avg_minutes_last_{window}'] = df.groupby('name')['minutes'].apply(
-            lambda x: x.shift(1).rolling(window=window, min_periods=1).mean()).reset_index(drop=True)
+        df[f'avg_minutes_last_{window}'] = _lagged_window_mean(df['minutes'], starts, window)
     return df
 
 
+@profiling.profiled
 def generate_rolling_form(df, form_over=[3,5,10]):
     """Generate a recent form metric for players based on their performance in the last `n` gameweeks."""
     df = df.sort_values(by=['name', 'season', 'gameweek'])
-    # Calculate the rolling average points over the last 3 matches for each player, excluding the current gameweek
+    # Calculate the rolling average points over the last n matches for each player, excluding the current gameweek
+    starts = _group_starts(df, ['name'])
     for window in form_over:
-        df[f'avg_points_last_{window}'] = df.groupby('name')['total_points'].apply(lambda x: x.shift(1).rolling(window=window, min_periods=1).mean()).reset_index(drop=True)
+        df[f'avg_points_last_{window}'] = _lagged_window_mean(df['total_points'], starts, window)
     return df
 
+@profiling.profiled
 def generate_rolling_ict(df, features=['influence', 'creativity', 'threat'], window=3):
     """
     Generate average influence, threat, and creativity over the last x games.
     """
     df = df.sort_values(by=['name', 'season', 'gameweek'])
+    # Ensure no season overlap
+    starts = _group_starts(df, ['name', 'season'])
     for col in features:
-        # Ensure no season overlap
-        df[col + f'_avg_last_{window}_games'] = df.groupby(['name', 'season'])[col].apply(
-            lambda group: group.rolling(window=window, min_periods=1).mean().shift()
-        ).reset_index(drop=True)
+        df[col + f'_avg_last_{window}_games'] = _lagged_window_mean(df[col], starts, window)
 
-    df.fillna(0, inplace=True)    
+    _fillna(df, 0)
     return df
 
-def encode_positions(df):
+
+FEATURE_SPEC = {
+    'difficulty': True,
+    'form_windows': [3, 5, 10],
+    'minutes_windows': [1, 2, 3, 4, 5],
+    'ict_features': ['influence', 'creativity', 'threat'],
+    'ict_window': 3,
+    'fillna': 0,
+    'ppg': True,
+}
+
+
+@profiling.profiled
+def generate_features(df, spec=FEATURE_SPEC):
+    """
+    Generate every rolling and average feature in a single pass over the data.
+
+    Sorts the frame once and produces the same columns as running generate_difficulty_feature,
+    generate_rolling_form, get_rolling_avg_mins, generate_rolling_ict and get_avg_ppg in that order.
+
+    Parameters:
+    - df: player DataFrame
+    - spec: dict, which features to build and over which windows. Keys missing from the
+        spec fall back to FEATURE_SPEC, an empty list of windows or features skips that feature.
+    """
+    spec = {**FEATURE_SPEC, **spec}
+    df = df.sort_values(by=['name', 'season', 'gameweek']).reset_index(drop=True)
+    if spec['difficulty']:
+        df = _add_difficulty_feature(df)
+
+    player_starts = _group_starts(df, ['name'])
+    season_starts = _group_starts(df, ['name', 'season'])
+    new_columns = {}
+    for window in spec['form_windows']:
+        new_columns[f'avg_points_last_{window}'] = _lagged_window_mean(df['total_points'], player_starts, window)
+    for window in spec['minutes_windows']:
+        new_columns[f'avg_minutes_last_{window}'] = _lagged_window_mean(df['minutes'], player_starts, window)
+    for col in spec['ict_features']:
+        new_columns[col + f'_avg_last_{spec["ict_window"]}_games'] = _lagged_window_mean(df[col], season_starts, spec['ict_window'])
+    df = pd.concat([df, pd.DataFrame(new_columns, index=df.index)], axis=1)
+
+    if spec['fillna'] is not None:
+        _fillna(df, spec['fillna'])
+    if spec['ppg']:
+        df = _add_avg_ppg(df)
+    return df
+
+
+@profiling.profiled
+def encode_positions(df, sparse=False, codes=False):
+    """
+    One-hot encode player positions.
+
+    Parameters:
+    - df: player DataFrame
+    - sparse: bool, store the encoding as sparse uint8 columns
+    - codes: bool, replace the position with an integer `position_code` column (position in
+        schema.POSITIONS, -1 when missing) instead of one-hot columns
+    """
+    if codes:
+        position = pd.Categorical(df['position'], categories=schema.POSITIONS)
+        return df.drop('position', axis=1).assign(position_code=position.codes)
+    if sparse:
+        return pd.get_dummies(df, columns=['position'], sparse=True, dtype=np.uint8)
     return pd.get_dummies(df, columns=['position'])
 
-def encode_teams(df):
-    """Change categorical variable of team and opponent team to encoding feature with full names."""
-    df['team_encoded'] = df['team'].str.replace(' ', '_', regex=False)
-    df['opponent_team_encoded'] = df['opponent_team_name'].str.replace(' ', '_', regex=False)
-    team_dummies = pd.get_dummies(df['team_encoded']).add_prefix('team_')
-    opponent_team_dummies = pd.get_dummies(df['opponent_team_encoded']).add_prefix('opponent_team_')
-    df = df.drop(['team', 'opponent_team_name', 'team_encoded', 'opponent_team_encoded'], axis=1)
-    df = pd.concat([df, team_dummies, opponent_team_dummies], axis=1)
-    return df
\ No newline at end of file
+def _team_categorical(values, teams):
+    categories = teams if teams is not None else sorted(values.dropna().unique())
+    encoded = pd.Categorical(values, categories=categories)
+    unknown = pd.notna(values) & (encoded.codes < 0)
+    if unknown.any():
+        raise ValueError(f'Teams missing from the vocabulary: {sorted(pd.unique(values[unknown]))}')
+    return encoded
+
+@profiling.profiled
+def encode_teams(df, teams=None, sparse=False, codes=False):
+    """
+    Change categorical variable of team and opponent team to encoding feature with full names.
+
+    Parameters:
+    - df: player DataFrame
+    - teams: list of team names to encode, such as schema.team_vocabulary, so every season gets the
+        same columns. Defaults to the teams present in the data. A team missing from the list raises ValueError.
+    - sparse: bool, store the one-hot columns as sparse uint8 columns
+    - codes: bool, replace the teams with integer `team_code` and `opponent_team_code` columns
+        (positions in `teams`, -1 when missing) instead of one-hot columns
+    """
+    team = _team_categorical(df['team'], teams)
+    opponent_team = _team_categorical(df['opponent_team_name'], teams)
+    df = df.drop(['team', 'opponent_team_name'], axis=1)
+    if codes:
+        return df.assign(team_code=team.codes, opponent_team_code=opponent_team.codes)
+
+    encoded = []
+    for values, prefix in [(team, 'team_'), (opponent_team, 'opponent_team_')]:
+        values = values.rename_categories([name.replace(' ', '_') for name in values.categories])
+        if sparse:
+            encoded.append(pd.get_dummies(values, sparse=True, dtype=np.uint8).add_prefix(prefix))
+        else:
+            encoded.append(pd.get_dummies(values).add_prefix(prefix))
+    df = pd.concat([df] + [dummies.set_axis(df.index) for dummies in encoded], axis=1)
+    return df
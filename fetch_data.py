@@ -1,43 +1,118 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime
-import pytz
 
+import data_loader
+import gw_cache
+import season_schema
+import profiling
+
+
+DATA_ROOT = 'https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data'
+SEASONS = ['2021-22', '2022-23', '2019-20', '2023-24', '2020-21']
+
+
+# Seconds files such as teams.csv are reused by a long running process before they are fetched again
+LOADER_TTL = 60 * 60
+
+_LOADERS = {}
+
+
+def get_loader(data_root=DATA_ROOT):
+    """Shared csv loader for a data root, so files such as teams.csv are only fetched once an hour."""
+    if data_root not in _LOADERS:
+        _LOADERS[data_root] = data_loader.csv_loader(data_root, ttl=LOADER_TTL)
+    return _LOADERS[data_root]
+
+
+def fixtures_fingerprint(data_root=DATA_ROOT, seasons=SEASONS):
+    """Cheap identity of the fixture and team files get_all_fixture_df reads, see data_loader.csv_loader.fingerprint."""
+    return get_loader(data_root).fingerprint([f'{season}/{name}.csv' for season in seasons for name in ['fixtures', 'teams']])
+
+
+def gameweeks_fingerprint(data_root=DATA_ROOT, seasons=SEASONS, cache_dir=None):
+    """
+    Cheap identity of the gameweek files get_gws reads. Seasons the gameweek cache holds completely
+    cannot change and are not checked again.
+    """
+    manifest = gw_cache.read_manifest(cache_dir) if cache_dir else {'seasons': {}}
+    complete = [season for season in seasons if manifest['seasons'].get(season, {}).get('complete')]
+    paths = [f'{season}/gws/gw{gw}.csv' for season in seasons if season not in complete
+             for gw in range(1, season_schema.gameweek_files(season) + 1)]
+    return {'complete': complete, 'files': get_loader(data_root).fingerprint(paths)}
+
+
+def _finished_gameweeks(fixtures):
+    """Gameweeks all of whose fixtures are finished, or None when the fixtures do not say."""
+    if fixtures is None or 'finished' not in fixtures.columns:
+        return None
+    finished = fixtures.dropna(subset=['event']).groupby('event')['finished'].all()
+    return set(finished.index[finished].astype(int))
+
+
+@profiling.profiled
+def get_gws(data_root=DATA_ROOT, seasons=SEASONS, cache_dir=None):
+    """
+    Get gameweek data for all seasons.
+
+    Parameters:
+    - data_root: str, base url or local directory mirroring the vaastav/Fantasy-Premier-League data folder
+    - seasons: list of seasons to load
+    - cache_dir: str, optional directory for the Parquet gameweek cache. Finished seasons are
+        then only downloaded once and later calls only fetch gameweeks newer than the manifest.
+        Gameweeks cached while still being played are provisional and fetched again until
+        the season's fixtures show them finished.
+    """
+    manifest = gw_cache.read_manifest(cache_dir) if cache_dir else {'seasons': {}}
+
+    # Plan every gameweek file missing from the cache, or cached while it was being played, and
+    #  fetch them in one concurrent batch together with the fixtures telling which are finished.
+    #  Files that do not exist yet come back as None and mark the end of the season.
+    planned = {}
+    for season in seasons:
+        entry = gw_cache.season_entry(manifest, season)
+        if not entry['complete']:
+            gw_cache.drop_provisional(manifest, season)
+            first_gw = max(entry['gameweeks'], default=0) + 1
+            planned[season] = range(first_gw, season_schema.gameweek_files(season) + 1)
+    loader = get_loader(data_root)
+    frames = loader.load_many([f'{season}/gws/gw{gw}.csv' for season, gws in planned.items() for gw in gws]
+                              + [f'{season}/fixtures.csv' for season in planned], keep=False)
 
-def get_gws():
-    base_filepath = f'https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data'
-    seasons = ['2021-22', '2022-23', '2019-20', '2023-24', '2020-21']
     all_dataframes = []
     for season in seasons:
-        if season != '2019-20':
-            for gw in range(1,39):
-                try:
-                    df = pd.read_csv(base_filepath + f'/{season}/gws/gw{gw}.csv')
-                    df['season'] = season
-                    df['gameweek'] = gw
-                    all_dataframes.append(df)
-                except Exception as ex:
-                    print(f"Gameweek {gw} for season {season} hasn't been played yet.")
-                    break
-        else:
-            for gw in range(1, 48):
-                try:
-                    # WEBSITE HAS MAPPING ISSUE WITH GW 30 AS 39 AND SO ON TO 47 WHICH IS GW 38 (ONLY 2019-20 DATA)
-                    df = pd.read_csv(base_filepath + f'/{season}/gws/gw{gw}.csv')
-                    df['season'] = season
-                    df['gameweek'] = gw if gw <=38 else gw-9
-                    all_dataframes.append(df)
-                except Exception as ex:
-                    print(f"Error occurred: {ex}")
-                    break
+        entry = gw_cache.season_entry(manifest, season)
+        if cache_dir:
+            all_dataframes.extend(gw_cache.load_season(cache_dir, manifest, season))
+        finished = _finished_gameweeks(frames.get(f'{season}/fixtures.csv'))
+        available = []
+        for gw in planned.get(season, []):
+            if frames[f'{season}/gws/gw{gw}.csv'] is None:
+                print(f"Gameweek {gw} for season {season} hasn't been played yet.")
+                break
+            available.append(gw)
+        for gw in available:
+            df = frames[f'{season}/gws/gw{gw}.csv']
+            df['season'] = season
+            df['gameweek'] = season_schema.gameweek_number(season, gw)
+            all_dataframes.append(df)
+            if cache_dir:
+                # Without fixtures to tell, the latest file of a season still being played is provisional
+                provisional = (season_schema.gameweek_number(season, gw) not in finished if finished is not None
+                               else gw == available[-1] and gw != season_schema.gameweek_files(season))
+                gw_cache.store_gw(cache_dir, manifest, season, gw, df, provisional=provisional)
+        entry['complete'] = season_schema.gameweek_files(season) in entry['gameweeks'] and not entry.get('provisional')
+        if cache_dir and entry['complete']:
+            gw_cache.compact_season(cache_dir, manifest, season)
+    if cache_dir:
+        gw_cache.write_manifest(cache_dir, manifest)
     return pd.concat(all_dataframes, ignore_index=True)
                 
 
-def add_opponent_team_info(player_data_df):
-    seasons = ['2021-22', '2022-23', '2019-20', '2023-24', '2020-21']
+def add_opponent_team_info(player_data_df, data_root=DATA_ROOT, seasons=SEASONS):
+    teams = get_loader(data_root).load_many([f'{season}/teams.csv' for season in seasons])
     all_teams_df = []
     for season in seasons:
-        df_team = pd.read_csv(f'https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data/{season}/teams.csv').assign(season=season)
+        df_team = teams[f'{season}/teams.csv'].assign(season=season)
         df_team.rename({'id':'team', 'name':'team_name'}, axis=1,inplace=True)
         all_teams_df.append(df_team[['season', 'team', 'team_name']])
         
@@ -55,14 +130,16 @@ def add_opponent_team_info(player_data_df):
 
     return player_data_df
 
-def get_all_fixture_df():
+@profiling.profiled
+def get_all_fixture_df(data_root=DATA_ROOT, seasons=SEASONS):
+    # Fixtures change as games are played and rescheduled, so they are always fetched again
+    loader = get_loader(data_root)
+    files = {**loader.load_many([f'{season}/teams.csv' for season in seasons]),
+             **loader.load_many([f'{season}/fixtures.csv' for season in seasons], keep=False)}
     player_data_dfs = []
-    seasons = ['2021-22', '2022-23', '2019-20', '2023-24', '2020-21']
     for season in seasons:
-        base_fixtures = f'https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data/{season}/fixtures.csv'
-        base_teams = f'https://raw.githubusercontent.com/vaastav/Fantasy-Premier-League/master/data/{season}/teams.csv'
-        df_fixtures = pd.read_csv(base_fixtures).assign(season=season)
-        df_teams = pd.read_csv(base_teams)
+        df_fixtures = files[f'{season}/fixtures.csv'].assign(season=season)
+        df_teams = files[f'{season}/teams.csv']
 
         # Add home team name and away team name to fixtures
         df_fixtures = df_fixtures.merge(
@@ -110,63 +187,135 @@ def get_all_fixture_df():
         ]
     ).reset_index()
 
+# Player data columns only known once the game has been played, which the projected rows do not have.
+#  `round` is the gameweek of the file, which the projected rows only have as `gameweek`.
+MATCH_STAT_COLUMNS = ['assists', 'bonus', 'bps', 'clean_sheets', 'goals_conceded', 'goals_scored', 'own_goals',
+                      'penalties_missed', 'penalties_saved', 'red_cards', 'saves', 'selected', 'starts',
+                      'transfers_balance', 'transfers_in', 'transfers_out', 'yellow_cards', 'score', 'opponent_score',
+                      'team_a_score', 'team_h_score', 'round']
+
+# Player columns carried from each player's latest gameweek into the projected rows, the ones the
+# cleaning and feature steps read. Stats of the future games are unknown and left out.
+PROJECTION_COLUMNS = ['name', 'position', 'team', 'element', 'value', 'minutes', 'influence', 'creativity', 'threat',
+                      'ict_index', 'season']
+# Projected row column: fixture column it is taken from
+FIXTURE_COLUMNS = {'fixture': 'id', 'kickoff_time': 'kickoff_time', 'was_home': 'was_home', 'opponent_team': 'opponent',
+                   'opponent_team_name': 'opponent_name', 'difficulty': 'difficulty',
+                   'opponent_difficulty': 'opponent_difficulty'}
+
+
+class fixture_index():
+    def __init__(self, fixture_data):
+        """
+        Fixtures from get_all_fixture_df sorted by (season, team, event), so the fixtures of any
+        number of (season, team, event) keys are found with one vectorized lookup.
+
+        Parameters:
+        - fixture_data: fixture DataFrame with a row per team and fixture
+        """
+        fixtures = fixture_data.dropna(subset=['event']).assign(kickoff_time=lambda df: pd.to_datetime(df['kickoff_time'], utc=True))
+        fixtures = fixtures.sort_values('kickoff_time', kind='stable')
+        self.seasons = sorted(fixtures['season'].unique())
+        self.teams = sorted(fixtures['team_name'].unique())
+        keys = self._keys(fixtures['season'], fixtures['team_name'], fixtures['event'].to_numpy(dtype=np.int64))
+        order = np.argsort(keys, kind='stable')
+        self.fixtures = fixtures.iloc[order].reset_index(drop=True)
+        self.keys = keys[order]
+
+    def _keys(self, seasons, teams, events):
+        season_codes = pd.Categorical(seasons, categories=self.seasons).codes.astype(np.int64)
+        team_codes = pd.Categorical(teams, categories=self.teams).codes.astype(np.int64)
+        # Gameweeks run up to 47 (2019-20), so 64 events per team keep the keys unique
+        keys = (season_codes * len(self.teams) + team_codes) * 64 + events
+        return np.where((season_codes < 0) | (team_codes < 0), -1, keys)
+
+    def lookup(self, seasons, teams, events):
+        """
+        Find the fixtures of every (season, team, event) key.
+
+        Returns:
+        Tuple of arrays `rows` and `fixture_rows`: one entry per fixture of each key (two for a
+        double gameweek), with `rows` the position of the key and `fixture_rows` the position of the
+        fixture in `self.fixtures`. Keys without a fixture (blank gameweeks) get one entry with
+        fixture row -1.
+        """
+        keys = self._keys(seasons, teams, np.asarray(events, dtype=np.int64))
+        start = np.searchsorted(self.keys, keys, side='left')
+        counts = np.where(keys < 0, 0, np.searchsorted(self.keys, keys, side='right') - start)
+        n_entries = np.maximum(counts, 1)
+        rows = np.repeat(np.arange(len(keys)), n_entries)
+        offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_entries) - n_entries, n_entries)
+        fixture_rows = np.where(np.repeat(counts, n_entries) > 0, np.repeat(start, n_entries) + offsets, -1)
+        return rows, fixture_rows
+
+
+@profiling.profiled
+def build_projection(player_data, fixture_data, num_gameweeks=1, now=None, skip_current=False, index=None):
+    """
+    Rows to predict for the upcoming gameweeks: every player of the current season joined to each
+    of their team's fixtures in the next `num_gameweeks` gameweeks.
+
+    The current season is the one with fixtures after `now`. Players are taken from their latest
+    row of the season, kept if they played in the last completed gameweek or their team had no
+    fixture in it. A double gameweek gives a player two rows, a blank gameweek one row with no
+    fixture (missing `fixture`, opponent and difficulty).
+
+    Parameters:
+    - player_data: player DataFrame from get_all_player_data
+    - fixture_data: fixture DataFrame from get_all_fixture_df
+    - num_gameweeks: int, number of upcoming gameweeks
+    - now: timestamp, fixtures kicking off after it are upcoming, defaults to the current time
+    - skip_current: bool, skip the first upcoming gameweek, for testing while it is being played
+    - index: fixture_index of `fixture_data`, built when not given
+
+    Returns:
+    DataFrame with the PROJECTION_COLUMNS, `gameweek`, the FIXTURE_COLUMNS and a missing `total_points`.
+    """
+    index = index if index is not None else fixture_index(fixture_data)
+    now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+    now = now.tz_localize('UTC') if now.tzinfo is None else now
+    upcoming = index.fixtures[index.fixtures['kickoff_time'] > now]
+    if upcoming.empty:
+        raise ValueError(f'No fixtures after {now}.')
+    season = upcoming['season'].max()
+    events = np.sort(upcoming.loc[upcoming['season'] == season, 'event'].unique()).astype(np.int64)
+    current_event = events[0]
+    events = events[1:num_gameweeks + 1] if skip_current else events[:num_gameweeks]
+
+    played = player_data[(player_data['season'] == season) & (player_data['gameweek'] < current_event)]
+    last_gameweek = played['gameweek'].max()
+    latest = played.sort_values('gameweek', kind='stable').drop_duplicates('name', keep='last')
+    teams_played = index.fixtures.loc[(index.fixtures['season'] == season) & (index.fixtures['event'] == last_gameweek), 'team_name']
+    latest = latest[(latest['gameweek'] == last_gameweek) | ~latest['team'].isin(teams_played)]
+    players = latest[[col for col in PROJECTION_COLUMNS if col in latest.columns]].reset_index(drop=True)
+
+    # One entry per player and upcoming gameweek, joined to the fixtures of their team in that gameweek
+    player_rows = np.repeat(np.arange(len(players)), len(events))
+    gameweeks = np.tile(events, len(players))
+    rows, fixture_rows = index.lookup(np.full(len(player_rows), season), players['team'].to_numpy()[player_rows], gameweeks)
+
+    projection = players.iloc[player_rows[rows]].reset_index(drop=True)
+    projection['minutes'] = np.where(projection['minutes'] <= 30, 60, 90)
+    projection['gameweek'] = gameweeks[rows]
+    has_fixture = fixture_rows >= 0
+    for col, fixture_col in FIXTURE_COLUMNS.items():
+        projection[col] = index.fixtures[fixture_col].iloc[np.where(has_fixture, fixture_rows, 0)].reset_index(drop=True).where(has_fixture)
+    projection['total_points'] = np.nan
+    return projection
+
 def get_future_gameweeks(player_data, fixture_data, num_gameweeks=1, test=False):
-    current_time = datetime.utcnow()
-    current_time = current_time.replace(tzinfo=pytz.UTC)
-    fixture_data['kickoff_time'] = pd.to_datetime(fixture_data['kickoff_time'])
-    futr_fxtr = fixture_data[fixture_data['kickoff_time'] > current_time]
-
-    # TODO error handling if gameweek range does not exist
-    ## TESTING WHEN GAMEWEEK GOING ON
-    ##  Add 1 to num_gameweeks, select 2nd gameweek (i.e, if cur gameweek is 11, select 12 for testing)
-    if test:
-        next_gameweeks = sorted(futr_fxtr['event'].unique())[:num_gameweeks+1]
-        nxt_gw_fxtr = futr_fxtr[futr_fxtr['event'] == next_gameweeks[1]]
-        players_played_last_gw = player_data[(player_data['gameweek'] == nxt_gw_fxtr['event'].unique()[0] - 2) & (player_data['season'] == '2023-24')]
-        fut_gw_players = []
-        for gw in [next_gameweeks[1]]:
-            gw_x_players = players_played_last_gw.copy()
-            gw_x_players['gameweek'] = gw
-            fut_gw_players.append(gw_x_players)
-        players_played_last_gw = pd.concat(fut_gw_players)
-    else:
-        next_gameweeks = sorted(futr_fxtr['event'].unique())[:num_gameweeks]
-        nxt_gw_fxtr = futr_fxtr[futr_fxtr['event'].isin(next_gameweeks[0:])]
-        players_played_last_gw = player_data[(player_data['gameweek'] == nxt_gw_fxtr['event'].unique()[0] - 1) & (player_data['season'] == '2023-24')]
-        #Duplicate players that were registered per club for the last completed gameweek
-        #  for number of gameweeks we want
-        fut_gw_players = []
-        for gw in next_gameweeks:
-            gw_x_players = players_played_last_gw.copy()
-            gw_x_players['gameweek'] = gw
-            fut_gw_players.append(gw_x_players)
-        players_played_last_gw = pd.concat(fut_gw_players)
-
-    # Edit last gw's data to future gameweeks's data
-    drop_cols = ['difficulty', 'opponent_difficulty', 'opponent_team_name', 'opponent_team', 'kickoff_time']
-    players_played_last_gw.drop(columns=drop_cols, inplace=True)
-    players_played_last_gw['minutes'] = players_played_last_gw['minutes'].apply(lambda x: 60 if x <= 30 else 90)
-    next_gw = players_played_last_gw.merge(nxt_gw_fxtr[['event', 'team_name', 'id', 'kickoff_time', 'opponent', 'difficulty', 'opponent_difficulty', 'opponent_name']],
-                                                left_on=['team', 'gameweek'],
-                                                right_on=['team_name', 'event'],
-                                                how='left')
-    next_gw['kickoff_time'] = pd.to_datetime(next_gw['kickoff_time'])
-    next_gw['gameweek'] = next_gw['event']
-    next_gw['opponent_team'] = next_gw['opponent']
-    next_gw['opponent_team_name'] = next_gw['opponent_name']
-    next_gw['fixture'] = next_gw['id']
-    next_gw.drop(columns=['event', 'id', 'opponent', 'opponent_name', 'team_name'], inplace=True)
-    cols_to_nan = ['goals_scored', 'assists', 'clean_sheets', 'goals_conceded', 'penalties_missed',
-                'penalties_saved', 'yellow_cards', 'red_cards', 'saves', 'bonus', 'bps', 
-                'total_points', 'transfers_balance', 'transfers_in', 'transfers_out',
-                'selected', 'own_goals', 'score', 'opponent_score']
-    next_gw[cols_to_nan] = np.nan
-
-    return next_gw
-
-def get_all_player_data(fixtures):
+    """
+    Rows to predict for the next `num_gameweeks` gameweeks, see build_projection.
+
+    Parameters:
+    - test: bool, skip the gameweek being played, to test while a gameweek is going on
+    """
+    return build_projection(player_data, fixture_data, num_gameweeks, skip_current=test)
+
+@profiling.profiled
+def get_all_player_data(fixtures, data_root=DATA_ROOT, seasons=SEASONS, cache_dir=None):
     """Merges gameweek data with fixture data and future gameweek to create a master dataframe with all player data"""
-    player_gameweeks = get_gws()
+    player_gameweeks = get_gws(data_root, seasons, cache_dir)
 
     all_player_data = pd.merge(player_gameweeks, 
                                  fixtures[['season', 'id', 'team_name', 'kickoff_time', 'difficulty', 'opponent_difficulty', 'score', 'opponent_score']], 
@@ -181,5 +330,5 @@ def get_all_player_data(fixtures):
     
     # Dropping redundant columns
     all_player_data.drop(columns=['id', 'team_name'], inplace=True)
-    all_player_data = add_opponent_team_info(all_player_data)
+    all_player_data = add_opponent_team_info(all_player_data, data_root, seasons)
     return all_player_data
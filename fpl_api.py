@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import data_loader
+import schema
+
+FPL_API = 'https://fantasy.premierleague.com/api'
+# Squad positions 1 to 11 start, 12 to 15 are the bench in order
+N_STARTERS = 11
+
+
+class requests_transport():
+    def __init__(self, pool_size=16, timeout=10, retries=3, backoff_factor=0.5):
+        """
+        HTTP transport over a pooled requests session.
+
+        Any object with the same `get` method can be given to fpl_client instead, such as a stub
+        serving saved payloads in tests.
+
+        Parameters:
+        - pool_size: int, number of pooled connections, at least the client's `max_workers`
+        - timeout: float, per request timeout in seconds
+        - retries: int, times to retry failed connections, 429 and 5xx responses
+        - backoff_factor: float, seconds to wait before the first retry
+        """
+        self.session = data_loader.make_session(pool_size, retries, backoff_factor)
+        self.timeout = timeout
+
+    def get(self, url, headers={}):
+        """
+        GET a url.
+
+        Returns:
+        Tuple of the status code, the response headers and the body bytes.
+        """
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        return response.status_code, response.headers, response.content
+
+
+class fpl_client():
+    def __init__(self, base_url=FPL_API, transport=None, max_workers=16, ttl=300, cache_dir=None):
+        """
+        Client for the public FPL API.
+
+        Responses are cached for `ttl` seconds. Once an entry expires it is revalidated with its
+        ETag / Last-Modified, so unchanged payloads come back as an empty 304 instead of being
+        downloaded again. Bulk calls run at most `max_workers` requests at a time.
+
+        Parameters:
+        - base_url: str, API root, such as the url of a local stub server
+        - transport: object with a `get(url, headers)` method, defaults to requests_transport
+        - max_workers: int, most concurrent requests
+        - ttl: float, seconds a response is used without asking the server
+        - cache_dir: str, optional directory to keep the responses in between runs
+        """
+        self.base_url = base_url.rstrip('/')
+        self.transport = transport or requests_transport(pool_size=max_workers)
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._cache = {}
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_file(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(path.encode()).hexdigest() + '.json')
+
+    def _cached(self, path):
+        with self._lock:
+            entry = self._cache.get(path)
+        if entry is None and self.cache_dir and os.path.exists(self._cache_file(path)):
+            with open(self._cache_file(path)) as f:
+                entry = json.load(f)
+            with self._lock:
+                self._cache[path] = entry
+        return entry
+
+    def _store(self, path, entry):
+        with self._lock:
+            self._cache[path] = entry
+        if self.cache_dir:
+            file_name = self._cache_file(path)
+            with open(file_name + '.tmp', 'w') as f:
+                json.dump(entry, f)
+            os.replace(file_name + '.tmp', file_name)
+
+    def get_json(self, path, ttl=None):
+        """
+        Get an API payload.
+
+        Parameters:
+        - path: str, path under the API root, such as 'bootstrap-static/'
+        - ttl: float, seconds a cached response is used without asking the server, defaults to the client's
+
+        Returns:
+        The parsed JSON, or None if the server has no such resource.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        entry = self._cached(path)
+        if entry is not None and time.time() - entry['fetched_at'] < ttl:
+            return entry['data']
+
+        headers = {}
+        if entry is not None and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        status, response_headers, body = self.transport.get(f'{self.base_url}/{path}', headers)
+
+        if status == 304 and entry is not None:
+            self._store(path, {**entry, 'fetched_at': time.time()})
+            return entry['data']
+        if status == 404:
+            # Missing resources are cached too, so a deleted manager is not asked for again until the entry expires
+            self._store(path, {'data': None, 'etag': None, 'last_modified': None, 'fetched_at': time.time()})
+            return None
+        if status != 200:
+            raise RuntimeError(f'FPL API error {status} for {path}: {body[:200]!r}')
+        data = json.loads(body)
+        self._store(path, {'data': data, 'etag': response_headers.get('ETag'),
+                           'last_modified': response_headers.get('Last-Modified'), 'fetched_at': time.time()})
+        return data
+
+    def get_many(self, paths, ttl=None):
+        """
+        Get many payloads concurrently, see `get_json`. A path that fails, such as with a 5xx
+        once the retries are used up, is reported in the errors and the others carry on.
+
+        Returns:
+        Tuple of a dict mapping each path that was fetched to its payload and a dict mapping each
+        path that failed to its exception.
+        """
+        paths = list(dict.fromkeys(paths))
+        if not paths:
+            return {}, {}
+
+        def fetch(path):
+            try:
+                return self.get_json(path, ttl), None
+            except Exception as ex:
+                return None, ex
+
+        payloads, errors = {}, {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(paths))) as executor:
+            for path, (payload, error) in zip(paths, executor.map(fetch, paths)):
+                if error is None:
+                    payloads[path] = payload
+                else:
+                    errors[path] = error
+        return payloads, errors
+
+    def bootstrap_static(self):
+        """Season wide data: every player ('elements'), team and gameweek ('events')."""
+        return self.get_json('bootstrap-static/')
+
+    def current_event(self):
+        """Id of the current gameweek, None before the season starts."""
+        return next((event['id'] for event in self.bootstrap_static()['events'] if event['is_current']), None)
+
+    def players(self):
+        """
+        DataFrame of every player in the game, one row per element, with its team name and its
+        position spelled as in schema.POSITIONS.
+        """
+        data = self.bootstrap_static()
+        players = pd.DataFrame(data['elements'])
+        teams = {team['id']: team['name'] for team in data['teams']}
+        positions = {element_type['id']: schema.POSITIONS[element_type['id'] - 1] for element_type in data['element_types']}
+        return players.assign(team_name=players['team'].map(teams), position=players['element_type'].map(positions))
+
+    def fetch_teams(self, team_ids, event=None):
+        """
+        Fetch the squads of many FPL managers, such as a whole mini-league.
+
+        Uses the public picks of each manager for a gameweek, which need no login.
+
+        Parameters:
+        - team_ids: list of manager (entry) ids
+        - event: int, gameweek, defaults to the current one
+
+        Returns:
+        Tuple of a dict mapping each fetched id to a dict with the element ids of the 'starting_11'
+        and the 'bench', or to None if the manager was not found, and a dict mapping each id whose
+        request failed to its exception.
+        """
+        event = event or self.current_event()
+        if event is None:
+            raise ValueError('No gameweek has started yet, so there are no picks to fetch.')
+        paths = {team_id: f'entry/{team_id}/event/{event}/picks/' for team_id in team_ids}
+        payloads, path_errors = self.get_many(paths.values())
+        teams, errors = {}, {}
+        for team_id, path in paths.items():
+            if path in path_errors:
+                errors[team_id] = path_errors[path]
+                continue
+            picks = payloads[path]['picks'] if payloads[path] else None
+            teams[team_id] = None if picks is None else {
+                'starting_11': [pick['element'] for pick in picks if pick['position'] <= N_STARTERS],
+                'bench': [pick['element'] for pick in picks if pick['position'] > N_STARTERS],
+            }
+        return teams, errors
+
+    def fetch_team(self, team_id, event=None):
+        """Fetch one manager's squad, see `fetch_teams`. Raises the error if the request failed."""
+        teams, errors = self.fetch_teams([team_id], event)
+        if team_id in errors:
+            raise errors[team_id]
+        return teams[team_id]
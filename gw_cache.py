@@ -0,0 +1,86 @@
+import os
+import json
+import pandas as pd
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def read_manifest(cache_dir):
+    """Read the cache manifest, returning an empty one if the cache has not been created yet."""
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'seasons': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(cache_dir, manifest):
+    """Atomically replace the manifest so an interrupted refresh never leaves it half written."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def season_entry(manifest, season):
+    """Get (creating if needed) the manifest entry for a season."""
+    return manifest['seasons'].setdefault(season, {'gameweeks': [], 'complete': False})
+
+
+def partition_path(cache_dir, season, gw):
+    """Path of the Parquet partition holding gameweek file `gw` of `season`."""
+    return os.path.join(cache_dir, season, f'gw{gw}.parquet')
+
+
+def season_path(cache_dir, season):
+    """Path of the single Parquet file a finished season is compacted into."""
+    return os.path.join(cache_dir, season, 'season.parquet')
+
+
+def store_gw(cache_dir, manifest, season, gw, df, provisional=False):
+    """
+    Write one gameweek partition and record it in the manifest.
+
+    Partitions of a gameweek that is still being played are recorded as provisional and
+    fetched again by later calls until the gameweek is finished.
+    """
+    path = partition_path(cache_dir, season, gw)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path, index=False)
+    entry = season_entry(manifest, season)
+    if gw not in entry['gameweeks']:
+        entry['gameweeks'].append(gw)
+        entry['gameweeks'].sort()
+    if provisional:
+        entry['provisional'] = sorted(set(entry.get('provisional', [])) | {gw})
+
+
+def drop_provisional(manifest, season):
+    """Forget the provisional gameweeks of a season so they are fetched again, returning them."""
+    entry = season_entry(manifest, season)
+    provisional = entry.pop('provisional', [])
+    entry['gameweeks'] = [gw for gw in entry['gameweeks'] if gw not in provisional]
+    return provisional
+
+
+def compact_season(cache_dir, manifest, season):
+    """Merge the gameweek partitions of a finished season into one file so warm loads open a single file."""
+    entry = season_entry(manifest, season)
+    if entry.get('compacted') or entry.get('provisional') or not entry['gameweeks']:
+        return
+    df = pd.concat(load_season(cache_dir, manifest, season), ignore_index=True)
+    df.to_parquet(season_path(cache_dir, season), index=False)
+    entry['compacted'] = True
+    write_manifest(cache_dir, manifest)
+    for gw in entry['gameweeks']:
+        os.remove(partition_path(cache_dir, season, gw))
+
+
+def load_season(cache_dir, manifest, season):
+    """Load every cached gameweek partition of a season, in gameweek order."""
+    entry = season_entry(manifest, season)
+    if entry.get('compacted'):
+        return [pd.read_parquet(season_path(cache_dir, season))]
+    return [pd.read_parquet(partition_path(cache_dir, season, gw)) for gw in entry['gameweeks']]
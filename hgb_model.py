@@ -0,0 +1,66 @@
+from sklearn.ensemble import HistGradientBoostingRegressor
+from threadpoolctl import threadpool_limits
+import scipy.sparse
+
+from xp_model import base_xp_model
+import profiling
+
+# Integer coded columns from feature_utils.encode_teams(codes=True) and encode_positions(codes=True)
+CATEGORICAL_FEATURES = ['team_code', 'opponent_team_code', 'position_code']
+
+
+class hgb_xp_model(base_xp_model):
+    def __init__(self, max_iter=500, learning_rate=0.05, max_leaf_nodes=31, min_samples_leaf=20, l2_regularization=0.0,
+                 max_bins=255, early_stopping=True, validation_fraction=0.1, n_iter_no_change=20,
+                 categorical_features=CATEGORICAL_FEATURES, n_jobs=-1, random_state=None):
+        """
+        Histogram gradient boosting xP model. Features are binned into at most `max_bins` values,
+        which makes training much faster and the model much smaller than the random forest.
+
+        Parameters:
+        - early_stopping: bool, stop adding trees once the MAE of the latest `validation_fraction`
+            of the training rows has not improved for `n_iter_no_change` iterations
+        - categorical_features: list of integer coded columns split on as categories, such as teams
+            and positions, instead of as ordered numbers
+        - n_jobs: int, number of threads used to fit, -1 for every core
+        """
+        self.categorical_features = categorical_features
+        self.validation_fraction = validation_fraction
+        self.n_jobs = n_jobs
+        self.model = HistGradientBoostingRegressor(max_iter=max_iter, learning_rate=learning_rate,
+                                                   max_leaf_nodes=max_leaf_nodes, min_samples_leaf=min_samples_leaf,
+                                                   l2_regularization=l2_regularization, max_bins=max_bins,
+                                                   early_stopping=early_stopping, n_iter_no_change=n_iter_no_change,
+                                                   scoring='neg_mean_absolute_error', random_state=random_state)
+
+    def _matrix(self, X):
+        """Histogram boosting needs dense inputs, sparse one-hot columns are densified."""
+        X = super()._matrix(X)
+        return X.toarray() if scipy.sparse.issparse(X) else X
+
+    @profiling.profiled
+    def fit(self, X, y, columns=None):
+        """
+        Fits the model on prepared model inputs.
+
+        With early stopping the last `validation_fraction` of the rows is held out to decide when
+        to stop, so the rows must be in time order for trees never to be chosen on gameweeks older
+        than the ones they were fitted on. Rows of a feature_matrix, and the training rows of
+        `train_model`, are in gameweek order.
+
+        Parameters:
+        - X: matrix of model inputs, in time order
+        - y: target values
+        - columns: list of the column names of `X`, used to find the categorical columns
+        """
+        columns = list(X.columns) if columns is None and hasattr(X, 'columns') else columns
+        categorical = [col in self.categorical_features for col in columns or []]
+        self.model.set_params(categorical_features=categorical if any(categorical) else None)
+
+        fit_params = {}
+        if self.model.early_stopping:
+            split = len(y) - int(round(len(y) * self.validation_fraction))
+            fit_params = {'X_val': X[split:], 'y_val': y[split:]}
+            X, y = X[:split], y[:split]
+        with threadpool_limits(limits=self.n_jobs if self.n_jobs and self.n_jobs > 0 else None, user_api='openmp'):
+            self.model.fit(X, y, **fit_params)
@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import hashlib
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error
+
+from feature_matrix import feature_matrix, row_count
+from rf_model import rf_xp_model
+from hgb_model import hgb_xp_model
+
+MODELS = {'rf': rf_xp_model, 'hgb': hgb_xp_model}
+
+
+def get_model(name, **params):
+    """Create a registered xP model by name, see MODELS."""
+    return MODELS[name](**params)
+
+
+def param_grid(grid):
+    """Expand a dict of parameter lists into a list of parameter dicts."""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def _matrix_fingerprint(fm):
+    """Identifies the contents of a feature matrix without reading it."""
+    stat = os.stat(os.path.join(fm.path, 'X.npy'))
+    return [os.path.abspath(fm.path), stat.st_size, stat.st_mtime_ns, fm.schema['n_labelled']]
+
+
+def _fold_key(model_name, params, fold, fingerprint):
+    payload = json.dumps([model_name, params, fold, fingerprint], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _fit_fold(model_class, params, path, train, valid, measure_artifact=False):
+    """Fit one configuration on one fold. Runs in a worker process that maps the matrix from disk."""
+    fm = feature_matrix(path)
+    model = model_class(**params)
+    start = time.perf_counter()
+    model.fit(fm.X[train], fm.y[train], fm.columns)
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    predictions = model.predict(fm.X[valid])
+    predict_seconds = time.perf_counter() - start
+    result = {'mae': float(mean_absolute_error(fm.y[valid], predictions)), 'fit_seconds': fit_seconds,
+              'predict_seconds': predict_seconds, 'valid_rows': row_count(valid)}
+    if measure_artifact:
+        with tempfile.TemporaryDirectory() as tmp:
+            file_name = os.path.join(tmp, 'model.joblib')
+            joblib.dump(model.model, file_name)
+            result['artifact_bytes'] = os.path.getsize(file_name)
+    return result
+
+
+def _read_cache(cache_file):
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            return json.load(f)
+    return {}
+
+
+def _write_cache(cache_file, cache):
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, cache_file)
+
+
+def walk_forward_search(fm, grid, model_class=rf_xp_model, n_folds=4, max_workers=None, cache_file=None,
+                        time_budget=None):
+    """
+    Time ordered hyperparameter search using every core.
+
+    Every configuration is fitted on each walk-forward fold of the feature matrix (train on earlier
+    gameweeks, validate on later ones) in a process pool. Workers memory-map the matrix, so it is
+    never copied between processes. Each worker fits single threaded unless there are fewer tasks
+    than cores.
+
+    Parameters:
+    - fm: feature_matrix to search on
+    - grid: dict of parameter lists, or list of parameter dicts, passed to `model_class`
+    - model_class: model wrapper class exposing a scikit-learn estimator as `.model`
+    - n_folds: int, number of walk-forward folds
+    - max_workers: int, number of worker processes, defaults to the number of cores
+    - cache_file: str, optional JSON file of finished fold results, repeated searches skip them
+    - time_budget: float, optional soft limit in seconds. Once it has passed folds that have not
+        started are skipped, but folds already running are finished, so a search can overrun the
+        budget by up to one fold.
+
+    Returns:
+    DataFrame with one row per configuration: its parameters, as columns and as a dict in `params`,
+    mean validation MAE, MAE per fold, summed fit and predict seconds, the number of folds that
+    finished and the errors of the folds that failed, sorted by MAE. Failed folds are not cached and are tried again by the next search.
+    """
+    configs = param_grid(grid) if isinstance(grid, dict) else list(grid)
+    folds = fm.walk_forward(n_folds)
+    fingerprint = _matrix_fingerprint(fm)
+    cache = _read_cache(cache_file)
+
+    max_workers = max_workers or os.cpu_count()
+    tasks = {}
+    for config_id, params in enumerate(configs):
+        for fold_id, (train, valid) in enumerate(folds):
+            key = _fold_key(model_class.__name__, params, [row_count(train), row_count(valid)], fingerprint)
+            if key not in cache:
+                tasks[key] = (config_id, fold_id, train, valid)
+    n_jobs = max(1, (os.cpu_count() or 1) // max(1, min(max_workers, len(tasks))))
+
+    start = time.perf_counter()
+    errors = {config_id: [] for config_id in range(len(configs))}
+
+    def collect(future):
+        """Cache a finished fold, or record its error so the other folds carry on."""
+        config_id, fold_id, _, _ = tasks[futures[future]]
+        try:
+            cache[futures[future]] = {'params': configs[config_id], 'fold': fold_id, **future.result()}
+        except Exception as ex:
+            errors[config_id].append(f'fold {fold_id}: {ex!r}')
+            return
+        if cache_file:
+            _write_cache(cache_file, cache)
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_fit_fold, model_class, {**configs[config_id], 'n_jobs': n_jobs}, fm.path, train, valid): key
+                       for key, (config_id, fold_id, train, valid) in tasks.items()}
+            remaining = None if time_budget is None else max(0.0, time_budget - (time.perf_counter() - start))
+            done = set()
+            try:
+                for future in as_completed(futures, timeout=remaining):
+                    done.add(future)
+                    collect(future)
+            except TimeoutError:
+                # Over budget: skip the folds that have not started and wait for the running ones
+                for future in futures:
+                    future.cancel()
+                for future in futures:
+                    if future not in done and not future.cancelled():
+                        collect(future)
+
+    rows = []
+    for config_id, params in enumerate(configs):
+        results = [cache.get(_fold_key(model_class.__name__, params, [row_count(train), row_count(valid)], fingerprint)) for train, valid in folds]
+        results = [result for result in results if result is not None]
+        rows.append({
+            **params,
+            'params': params,
+            'mae': np.mean([result['mae'] for result in results]) if results else np.nan,
+            'fold_mae': [result['mae'] for result in results],
+            'fit_seconds': sum(result['fit_seconds'] for result in results),
+            'predict_seconds': sum(result['predict_seconds'] for result in results),
+            'folds_done': len(results),
+            'errors': errors[config_id],
+        })
+    report = pd.DataFrame(rows).sort_values('mae').reset_index(drop=True)
+    print(f'Searched {len(configs)} configurations on {len(folds)} folds in {time.perf_counter() - start:.1f}s')
+    return report
+
+
+def compare_models(fm, models={'rf': {}, 'hgb': {}}, n_folds=4, max_workers=None):
+    """
+    Compare xP models on the same walk-forward folds of a feature matrix.
+
+    Parameters:
+    - fm: feature_matrix to compare on
+    - models: dict of registered model name (see MODELS) to the parameters to create it with
+    - n_folds: int, number of walk-forward folds
+    - max_workers: int, number of worker processes, defaults to the number of cores
+
+    Returns:
+    DataFrame with one row per model: mean validation MAE, MAE per fold, summed fit seconds,
+    inference latency in milliseconds per 1000 rows and the mean size of the saved model in bytes.
+    """
+    folds = fm.walk_forward(n_folds)
+    max_workers = max_workers or os.cpu_count()
+    n_tasks = len(models) * len(folds)
+    n_jobs = max(1, (os.cpu_count() or 1) // max(1, min(max_workers, n_tasks)))
+
+    results = {name: [None] * len(folds) for name in models}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_fit_fold, MODELS[name], {**params, 'n_jobs': n_jobs}, fm.path, train, valid,
+                                   measure_artifact=True): (name, fold_id)
+                   for name, params in models.items() for fold_id, (train, valid) in enumerate(folds)}
+        for future in as_completed(futures):
+            name, fold_id = futures[future]
+            results[name][fold_id] = future.result()
+
+    rows = []
+    for name, folds_done in results.items():
+        rows.append({
+            'model': name,
+            'mae': np.mean([result['mae'] for result in folds_done]),
+            'fold_mae': [result['mae'] for result in folds_done],
+            'fit_seconds': sum(result['fit_seconds'] for result in folds_done),
+            'predict_ms_per_1k_rows': 1e6 * sum(result['predict_seconds'] for result in folds_done)
+                                      / sum(result['valid_rows'] for result in folds_done),
+            'artifact_bytes': np.mean([result['artifact_bytes'] for result in folds_done]),
+        })
+    return pd.DataFrame(rows).sort_values('mae').reset_index(drop=True)
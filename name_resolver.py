@@ -0,0 +1,150 @@
+import os
+import json
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+import numpy as np
+import pandas as pd
+
+
+def _bigrams(name):
+    return Counter(name[i:i + 2] for i in range(len(name) - 1))
+
+
+class name_resolver():
+    def __init__(self, threshold=0.9):
+        """
+        Resolves player names that are spelled slightly differently across seasons to one identity.
+
+        Names are matched against the `keys` (names that did not match anything when first seen) in the
+        order the keys were created, and a name belongs to the first key whose SequenceMatcher ratio with
+        it is above `threshold`. Only keys that can possibly reach the threshold are scored: candidates
+        are blocked by length and by an inverted character bigram index.
+
+        Parameters:
+        - threshold: float, SequenceMatcher ratio a name must exceed to match a key
+        """
+        self.threshold = threshold
+        self.keys = []
+        self.parent = {}
+        self._by_length = defaultdict(list)
+        self._postings = defaultdict(list)
+
+    def _min_matches(self, total_len):
+        """Smallest number of matching characters whose ratio exceeds the threshold."""
+        matches = int(self.threshold * total_len / 2)
+        while 2.0 * matches / total_len <= self.threshold:
+            matches += 1
+        return matches
+
+    def _candidates(self, name):
+        """
+        Ids of the keys that can reach the threshold with `name`, in key order.
+
+        A ratio above the threshold needs M matching characters spread over at most T - 2M + 1 matching
+        blocks (T is the combined length), so the names share at least 3M - T - 1 bigrams. Keys sharing
+        fewer bigrams, or whose length alone caps the ratio, are never scored.
+        """
+        shared = Counter()
+        for bigram, count in _bigrams(name).items():
+            for key_id, key_count in self._postings[bigram]:
+                shared[key_id] += min(count, key_count)
+
+        candidates = []
+        for length, key_ids in self._by_length.items():
+            total_len = len(name) + length
+            if 2.0 * min(len(name), length) / total_len <= self.threshold:
+                continue
+            min_shared = 3 * self._min_matches(total_len) - total_len - 1
+            if min_shared <= 0:
+                candidates.extend(key_ids)
+            else:
+                candidates.extend(key_id for key_id in key_ids if shared[key_id] >= min_shared)
+        return sorted(candidates)
+
+    def _add_key(self, name):
+        key_id = len(self.keys)
+        self.keys.append(name)
+        self.parent[name] = key_id
+        self._by_length[len(name)].append(key_id)
+        for bigram, count in _bigrams(name).items():
+            self._postings[bigram].append((key_id, count))
+
+    def resolve(self, names):
+        """
+        Assign every name not seen before to a key, in the given order.
+
+        Parameters:
+        - names: iterable of unique names, ordered by first appearance
+
+        Returns:
+        List with the key id of each name.
+        """
+        for name in names:
+            if name in self.parent:
+                continue
+            for key_id in self._candidates(name):
+                if SequenceMatcher(None, name, self.keys[key_id]).ratio() > self.threshold:
+                    self.parent[name] = key_id
+                    break
+            else:
+                self._add_key(name)
+        return [self.parent[name] for name in names]
+
+    def canonical_names(self, names):
+        """
+        Map a column of names, ordered from the most recent row to the oldest, to canonical names.
+
+        Follows the rules of the original row by row loop in clean_data.update_player_names: a key is
+        renamed to whichever of its matched names appears last in `names`, matched names keep their own
+        spelling and keys without matches keep theirs.
+
+        Parameters:
+        - names: Series of names
+
+        Returns:
+        Series of canonical names aligned with `names`.
+        """
+        codes, uniques = pd.factorize(names)
+        parent_ids = np.array(self.resolve(uniques), dtype=np.int64)
+        last_seen = np.zeros(len(uniques), dtype=np.int64)
+        np.maximum.at(last_seen, codes, np.arange(len(codes)))
+
+        is_key = np.array([self.keys[key_id] == name for key_id, name in zip(parent_ids, uniques)], dtype=bool)
+        matched = pd.DataFrame({'parent': parent_ids[~is_key], 'name': uniques[~is_key], 'last_seen': last_seen[~is_key]})
+        renamed_keys = matched.sort_values('last_seen').drop_duplicates('parent', keep='last').set_index('parent')['name']
+
+        canonical = np.asarray(uniques, dtype=object).copy()
+        key_positions = np.flatnonzero(is_key)
+        new_names = renamed_keys.reindex(parent_ids[key_positions]).to_numpy()
+        has_new_name = pd.notna(new_names)
+        canonical[key_positions[has_new_name]] = new_names[has_new_name]
+        return pd.Series(canonical[codes], index=names.index, name=names.name)
+
+    def save(self, file_name):
+        """
+        Saves the name to key mapping so later runs only resolve new names.
+
+        Parameters:
+        - file_name: str, path to save the mapping
+        """
+        with open(file_name, 'w') as f:
+            json.dump({'threshold': self.threshold, 'keys': self.keys, 'parent': self.parent}, f)
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Loads a saved mapping, returning an empty resolver if the file does not exist.
+
+        Parameters:
+        - file_name: str, path to load the mapping from
+        """
+        if not os.path.exists(file_name):
+            return cls()
+        with open(file_name) as f:
+            state = json.load(f)
+        resolver = cls(state['threshold'])
+        for name in state['keys']:
+            resolver._add_key(name)
+        resolver.parent.update(state['parent'])
+        return resolver
@@ -0,0 +1,391 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+import importlib
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import profiling
+import fetch_data
+import clean_data
+import feature_utils
+import feature_matrix
+import model_search
+import schema
+import team_opt
+import transfer_planner
+
+INDEX_FILE = 'index.json'
+
+
+def content_hash(obj):
+    """Hash of the contents of a stage output, so a source stage only invalidates later stages when its data changed."""
+    if isinstance(obj, pd.DataFrame):
+        digest = hashlib.sha256(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        digest.update(json.dumps([list(map(str, obj.columns)), list(map(str, obj.dtypes))]).encode())
+        return digest.hexdigest()
+    return joblib.hash(obj)
+
+
+def code_version(modules):
+    """Hash of the source code of the modules a stage runs."""
+    digest = hashlib.sha256()
+    for module in modules:
+        module = importlib.import_module(module) if isinstance(module, str) else module
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+class pipeline_stage():
+    def __init__(self, name, func, inputs=[], params=[], modules=[], source=False, fingerprint=None, fingerprint_inputs=[]):
+        """
+        A step of the pipeline.
+
+        Parameters:
+        - name: str, name other stages refer to its output by
+        - func: function called with the outputs of `inputs` as positional arguments and `params` as keyword arguments
+        - inputs: list of names of the stages whose outputs it takes
+        - params: list of names of the run parameters it takes
+        - modules: list of modules (or module names) whose source code versions the stage, defaults to the module of `func`
+        - source: bool, the stage reads data from outside the pipeline, such as the FPL data repository. Source
+            stages are identified by the hash of their output rather than of their inputs, so later stages only
+            run again when the data changed. Without a `fingerprint` they run every time.
+        - fingerprint: function returning a cheap JSON serializable identity of the data the stage reads from
+            outside the pipeline, such as file sizes and modification times. It is called with the outputs of
+            `fingerprint_inputs` as positional arguments and `params` as keyword arguments, and the stage only
+            runs when it changed. It is taken again after the stage ran, so a stage writing the files it reads
+            (such as the name resolver file) is reused by the next run.
+        - fingerprint_inputs: list of names of the stages whose outputs `fingerprint` takes
+        """
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.params = params
+        self.modules = modules or [inspect.getmodule(func)]
+        self.source = source
+        self.fingerprint = fingerprint
+        self.fingerprint_inputs = fingerprint_inputs
+
+
+class stage_cache():
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        """
+        Disk cache of stage outputs, keyed by the hash identifying each output.
+
+        Once the stored outputs exceed `max_bytes` the least recently used ones are evicted.
+
+        Parameters:
+        - cache_dir: str, directory to store the outputs in
+        - max_bytes: int, most bytes of outputs to keep
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        index_file = os.path.join(cache_dir, INDEX_FILE)
+        self.index = {}
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                self.index = json.load(f)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.joblib')
+
+    def _write_index(self):
+        index_file = os.path.join(self.cache_dir, INDEX_FILE)
+        with open(index_file + '.tmp', 'w') as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+        os.replace(index_file + '.tmp', index_file)
+
+    def resolve(self, key):
+        """Key of the stored output `key` refers to, following an alias."""
+        return self.index[key].get('target', key) if key in self.index else key
+
+    def __contains__(self, key):
+        key = self.resolve(key)
+        return key in self.index and os.path.exists(self._path(key))
+
+    def alias(self, key, target, stage_name):
+        """Make `key` refer to the stored output `target`, without storing it again."""
+        self.index[key] = {'stage': stage_name, 'bytes': 0, 'last_used': time.time(), 'target': target}
+        self._write_index()
+
+    def get(self, key):
+        """Load a stored output and mark it as recently used."""
+        key = self.resolve(key)
+        value = joblib.load(self._path(key))
+        self.index[key]['last_used'] = time.time()
+        self._write_index()
+        return value
+
+    def put(self, key, stage_name, value, keep=()):
+        """
+        Store an output, then evict the least recently used outputs until the cache fits in `max_bytes`.
+
+        Parameters:
+        - key: str, hash identifying the output
+        - stage_name: str, name of the stage that computed it
+        - value: output to store
+        - keep: keys never to evict, such as the outputs the current run may still load
+        """
+        path = self._path(key)
+        joblib.dump(value, path + '.tmp')
+        os.replace(path + '.tmp', path)
+        self.index[key] = {'stage': stage_name, 'bytes': os.path.getsize(path), 'last_used': time.time()}
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for old_key in sorted(self.index, key=lambda k: self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if old_key != key and old_key not in keep:
+                total -= self.index.pop(old_key)['bytes']
+                if os.path.exists(self._path(old_key)):
+                    os.remove(self._path(old_key))
+        self._write_index()
+
+
+class pipeline():
+    def __init__(self, stages, cache_dir, max_bytes=2 * 1024 ** 3):
+        """
+        Runs stages in order, reusing the stored output of any stage whose inputs, parameters and
+        code are unchanged since it last ran.
+
+        Each stage's output is stored as soon as it is computed, so a run that fails part way
+        resumes from the last finished stage when it is started again.
+
+        Parameters:
+        - stages: list of pipeline_stage, every stage after the stages it takes as inputs
+        - cache_dir: str, directory of the stage cache
+        - max_bytes: int, most bytes of stage outputs to keep on disk
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache = stage_cache(cache_dir, max_bytes)
+        self.report = []
+
+    def _needed(self, targets):
+        """Names of the target stages and every stage they depend on."""
+        needed, pending = set(), list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].inputs)
+        return needed
+
+    def _key(self, stage, params, keys, fingerprint=None):
+        payload = json.dumps([stage.name, code_version(stage.modules), {name: params.get(name) for name in stage.params},
+                              [keys[name] for name in stage.inputs], fingerprint], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def run(self, params={}, targets=None):
+        """
+        Run the pipeline.
+
+        Parameters:
+        - params: dict of run parameters, each stage gets the ones it declares
+        - targets: list of stage names to compute, defaults to the last stage
+
+        Returns:
+        Dict with the output of every target stage.
+        """
+        targets = targets or [list(self.stages)[-1]]
+        needed = self._needed(targets)
+        outputs, keys = {}, {}
+        self.report = []
+
+        def output(name):
+            if name not in outputs:
+                outputs[name] = self.cache.get(keys[name])
+            return outputs[name]
+
+        def run_stage(stage):
+            return stage.func(*[output(input_name) for input_name in stage.inputs],
+                              **{param: params[param] for param in stage.params if param in params})
+
+        def fingerprint(stage):
+            return stage.fingerprint(*[output(input_name) for input_name in stage.fingerprint_inputs],
+                                     **{param: params[param] for param in stage.params if param in params})
+
+        # Stage keys follow from the keys of their inputs, so only stages that have to run load their inputs
+        for name, stage in self.stages.items():
+            if name not in needed:
+                continue
+            start = time.perf_counter()
+            with profiling.stage(f'pipeline.{name}'):
+                if stage.source and stage.fingerprint is None:
+                    outputs[name] = run_stage(stage)
+                    keys[name] = content_hash([stage.name, content_hash(outputs[name])])
+                    status = 'ran'
+                else:
+                    key = self._key(stage, params, keys, fingerprint(stage) if stage.fingerprint else None)
+                    if key in self.cache:
+                        keys[name] = self.cache.resolve(key)
+                        status = 'cached'
+                    else:
+                        outputs[name] = run_stage(stage)
+                        keys[name] = content_hash([stage.name, content_hash(outputs[name])]) if stage.source else key
+                        self.cache.put(keys[name], name, outputs[name], keep=set(keys.values()))
+                        # Later runs find the output by its key before the run and, when running changed
+                        #  the fingerprint, by its key after it
+                        aliases = {key}
+                        if stage.fingerprint:
+                            aliases.add(self._key(stage, params, keys, fingerprint(stage)))
+                        for alias in aliases - {keys[name]}:
+                            self.cache.alias(alias, keys[name], name)
+                        status = 'ran'
+            self.report.append({'stage': name, 'status': status, 'seconds': time.perf_counter() - start, 'key': keys[name]})
+            print(f'{name}: {status} in {time.perf_counter() - start:.2f}s')
+        return {name: output(name) for name in targets}
+
+
+def _player_data(fixtures, data_root, seasons, gw_cache_dir=None, num_gameweeks=1):
+    """Played gameweeks and the upcoming ones to predict, in one frame."""
+    player_data = fetch_data.get_all_player_data(fixtures, data_root, seasons, gw_cache_dir)
+    future = fetch_data.get_future_gameweeks(player_data, fixtures, num_gameweeks)
+    return pd.concat([player_data, future], ignore_index=True)
+
+
+def _player_data_fingerprint(fixtures, data_root, seasons, gw_cache_dir=None, num_gameweeks=1):
+    """The gameweek files, and the fixtures kicked off so far, which decide the upcoming gameweeks."""
+    kicked_off = pd.to_datetime(fixtures['kickoff_time'], utc=True) <= pd.Timestamp.now(tz='UTC')
+    return [fetch_data.gameweeks_fingerprint(data_root, seasons, gw_cache_dir), int(kicked_off.sum())]
+
+
+def _resolver_fingerprint(resolver_file=None):
+    """Contents of the name resolver file the cleaning stage reads and updates."""
+    if not resolver_file or not os.path.exists(resolver_file):
+        return None
+    with open(resolver_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _features(cleaned, fixtures):
+    """Model ready frame with integer team and position codes and an `is_future` flag for the rows to predict."""
+    teams = schema.team_vocabulary(fixtures)
+    df = schema.compact_player_frame(cleaned.assign(is_future=cleaned['total_points'].isna()), teams)
+    df = feature_utils.generate_features(df)
+    df = feature_utils.encode_positions(df, codes=True)
+    df = feature_utils.encode_teams(df, teams=teams, codes=True)
+    return df.drop(columns=['difficulty_category'])
+
+
+# Feature frame columns that are not model inputs, shared with the feature matrix
+MODEL_DROP_COLUMNS = feature_matrix.DROP_COLUMNS
+
+
+def model_inputs(features):
+    """
+    Model inputs of a feature frame from `_features`.
+
+    Returns:
+    Tuple of the labelled rows in (season, gameweek) order, the model inputs of those rows, their
+    target, the rows to predict and their model inputs.
+    """
+    # Time ordered, models holding out their latest rows for early stopping rely on it
+    labelled = features[~features['is_future']].sort_values(['season', 'gameweek'], kind='stable')
+    future = features[features['is_future']]
+    drop_columns = [col for col in MODEL_DROP_COLUMNS if col in features.columns]
+    return (labelled, labelled.drop(columns=drop_columns), labelled['total_points'].to_numpy(),
+            future, future.drop(columns=drop_columns))
+
+
+def _feature_matrix(features, matrix_dir='feature_matrices'):
+    """
+    Write the model inputs of the feature frame as a memory-mapped feature matrix, see
+    feature_matrix.write_feature_matrix, which the search and model stages train from.
+
+    The matrix is written to a directory of `matrix_dir` named after the contents of the frame,
+    so the path a cached run returns always holds the matrix of that frame.
+
+    Returns:
+    str, directory of the matrix.
+    """
+    path = os.path.join(matrix_dir, content_hash(features)[:16])
+    # The schema file is written last, so a matrix whose writing was interrupted is written again
+    if not os.path.exists(os.path.join(path, feature_matrix.SCHEMA_FILE)):
+        feature_matrix.write_feature_matrix(features, path, labelled=~features['is_future'].to_numpy(dtype=bool))
+    return path
+
+
+def _search(matrix_path, model_name='rf', search_grid=None, search_cache_file=None):
+    """
+    Best parameters of `model_name` from a walk-forward search over `search_grid` on the feature
+    matrix, see model_search.walk_forward_search. Without a grid nothing is searched and the model
+    keeps its defaults.
+    """
+    if not search_grid:
+        return {}
+    report = model_search.walk_forward_search(feature_matrix.feature_matrix(matrix_path), search_grid,
+                                              model_search.MODELS[model_name], cache_file=search_cache_file)
+    best = report.iloc[0]
+    if not best['folds_done']:
+        raise RuntimeError(f"Every fold of the search failed: {best['errors']}")
+    return best['params']
+
+
+def _train(matrix_path, search_params, model_name='rf', model_params={}):
+    """Model fitted on the labelled rows of the feature matrix, `model_params` override the searched ones."""
+    fm = feature_matrix.feature_matrix(matrix_path)
+    model = model_search.get_model(model_name, **{**search_params, **model_params})
+    # Labelled rows are stored in (season, gameweek) order, which models holding out their latest
+    #  rows for early stopping rely on
+    labelled = fm.labelled
+    model.fit(fm.X[labelled], fm.y[labelled], fm.columns)
+    return model
+
+
+def _predict(features, model):
+    _, _, _, future, X = model_inputs(features)
+    # The same float32 values as the feature matrix the model was trained on
+    return future.assign(xP=model.predict(X.to_numpy(dtype=np.float32)))
+
+
+def _select_team(predictions, budget=1000):
+    """
+    Best team for the first upcoming gameweek, `budget` is in the units of `value`, tenths of a million.
+
+    Players are picked once: a double gameweek adds up the xP of both fixtures and a blank
+    gameweek counts as 0, see transfer_planner.horizon_arrays.
+    """
+    next_gameweek = predictions[predictions['gameweek'] == predictions['gameweek'].min()]
+    arrays = transfer_planner.horizon_arrays(next_gameweek)
+    xp = arrays['xp'][:, 0]
+    starting_11, substitutes = team_opt.solve_selection(xp, arrays['value'], arrays['position_codes'], arrays['team_codes'], budget)
+    players = next_gameweek.drop_duplicates('name').set_index('name').loc[arrays['ids']].reset_index().assign(xP=xp)
+    return players.iloc[np.concatenate([starting_11, substitutes])].assign(starter=[True] * len(starting_11) + [False] * len(substitutes))
+
+
+def default_stages():
+    """
+    Stages of the weekly run: fetch -> clean -> features -> feature_matrix -> search -> model ->
+    predictions -> select_team.
+
+    The fetch stages only run when the files they read changed, or a fixture kicked off, and the
+    cleaning stage when the name resolver file changed, so changing a later parameter such as the
+    budget only reruns the stages that take it.
+
+    Run parameters: data_root, seasons, gw_cache_dir, num_gameweeks, resolver_file, matrix_dir,
+    model_name, search_grid, search_cache_file, model_params and budget (tenths of a million, like `value`).
+    """
+    return [
+        pipeline_stage('fixtures', fetch_data.get_all_fixture_df, params=['data_root', 'seasons'], source=True,
+                       fingerprint=fetch_data.fixtures_fingerprint),
+        pipeline_stage('player_data', _player_data, inputs=['fixtures'],
+                       params=['data_root', 'seasons', 'gw_cache_dir', 'num_gameweeks'], source=True,
+                       fingerprint=_player_data_fingerprint, fingerprint_inputs=['fixtures']),
+        pipeline_stage('cleaned', clean_data.clean_player_data, inputs=['player_data', 'fixtures'], params=['resolver_file'],
+                       modules=['clean_data', 'name_resolver', 'season_schema'], fingerprint=_resolver_fingerprint),
+        pipeline_stage('features', _features, inputs=['cleaned', 'fixtures'],
+                       modules=['pipeline', 'feature_utils', 'schema']),
+        pipeline_stage('feature_matrix', _feature_matrix, inputs=['features'], params=['matrix_dir'],
+                       modules=['pipeline', 'feature_matrix']),
+        pipeline_stage('search', _search, inputs=['feature_matrix'], params=['model_name', 'search_grid', 'search_cache_file'],
+                       modules=['pipeline', 'model_search', 'feature_matrix', 'xp_model', 'rf_model', 'hgb_model']),
+        pipeline_stage('model', _train, inputs=['feature_matrix', 'search'], params=['model_name', 'model_params'],
+                       modules=['pipeline', 'feature_matrix', 'xp_model', 'rf_model', 'hgb_model']),
+        pipeline_stage('predictions', _predict, inputs=['features', 'model'], modules=['pipeline', 'xp_model']),
+        pipeline_stage('select_team', _select_team, inputs=['predictions'], params=['budget'],
+                       modules=['pipeline', 'team_opt', 'transfer_planner']),
+    ]
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Profiling is off unless enable() is called or WTB_PROFILE=1 is set, a disabled profiled
+# function costs one dictionary lookup per call
+_state = {'enabled': False, 'stack': [], 'records': [], 'explicit_copies': 0, 'copy': None,
+          'started_tracing': False}
+
+
+def _counting_copy(self, *args, **kwargs):
+    _state['explicit_copies'] += 1
+    return _state['copy'](self, *args, **kwargs)
+
+
+def enable(trace_memory=True):
+    """
+    Start recording profiled stages and functions.
+
+    Parameters:
+    - trace_memory: bool, record peak memory with tracemalloc, which slows allocations down
+    """
+    if _state['enabled']:
+        return
+    _state['enabled'] = True
+    # Leave tracemalloc to whoever started it if it was already tracing
+    _state['started_tracing'] = trace_memory and not tracemalloc.is_tracing()
+    if _state['started_tracing']:
+        tracemalloc.start()
+    # Count explicit DataFrame.copy calls while profiling, implicit copies made inside sort_values,
+    # merge, concat and the like don't go through it and show up in peak_bytes instead
+    _state['copy'] = pd.DataFrame.copy
+    pd.DataFrame.copy = _counting_copy
+
+
+def disable():
+    """Stop recording. Records made so far are kept until reset()."""
+    if not _state['enabled']:
+        return
+    _state['enabled'] = False
+    pd.DataFrame.copy = _state['copy']
+    if _state['started_tracing'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['started_tracing'] = False
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def reset():
+    """Clear the records."""
+    _state['records'] = []
+
+
+def _shape(obj):
+    """(rows, columns) of a DataFrame or array, or of the first one in a tuple."""
+    if isinstance(obj, tuple):
+        obj = next((item for item in obj if hasattr(item, 'shape')), None)
+    if isinstance(obj, (pd.DataFrame, pd.Series, np.ndarray)) or hasattr(obj, 'shape'):
+        shape = tuple(obj.shape)
+        return (shape[0] if shape else None, shape[1] if len(shape) > 1 else 1)
+    return (None, None)
+
+
+@contextmanager
+def stage(name, data=None):
+    """
+    Record a named stage, such as a pipeline step or part of a function.
+
+    Parameters:
+    - name: str, name of the stage
+    - data: DataFrame or array going into the stage, to record its row and column counts
+
+    Yields:
+    The stage record, set `record['rows_out']` and `record['cols_out']` to record the output size.
+    """
+    if not _state['enabled']:
+        yield {}
+        return
+    stack = _state['stack']
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # Fold the peak so far into the enclosing stage before this stage starts its own
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+        tracemalloc.reset_peak()
+    rows_in, cols_in = _shape(data)
+    record = {'name': name, 'path': ';'.join([frame['name'] for frame in stack] + [name]), 'rows_in': rows_in,
+              'cols_in': cols_in, 'rows_out': None, 'cols_out': None, '_memory': current if tracing else 0, '_peak': 0,
+              '_explicit_copies': _state['explicit_copies']}
+    stack.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall
+        record['cpu_seconds'] = time.process_time() - cpu
+        record['explicit_copies'] = _state['explicit_copies'] - record.pop('_explicit_copies')
+        peak = max(record.pop('_peak'), tracemalloc.get_traced_memory()[1] if tracing else 0)
+        record['peak_bytes'] = max(peak - record.pop('_memory'), 0) if tracing else None
+        stack.pop()
+        if stack:
+            stack[-1]['_peak'] = max(stack[-1]['_peak'], peak)
+        _state['records'].append(record)
+
+
+def profiled(func=None, name=None):
+    """
+    Decorator recording every call of a function as a stage, with the size of its first
+    DataFrame or array argument and of its result.
+
+    Parameters:
+    - func: function to profile
+    - name: str, name of the stage, defaults to module.function
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+    name = name or f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _state['enabled']:
+            return func(*args, **kwargs)
+        data = next((arg for arg in list(args) + list(kwargs.values()) if hasattr(arg, 'shape')), None)
+        with stage(name, data) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'], record['cols_out'] = _shape(result)
+        return result
+    return wrapper
+
+
+def records():
+    """DataFrame of the recorded stages, in the order they finished."""
+    return pd.DataFrame(_state['records'], columns=['name', 'path', 'wall_seconds', 'cpu_seconds', 'peak_bytes',
+                                                    'rows_in', 'cols_in', 'rows_out', 'cols_out',
+                                                    'explicit_copies'])
+
+
+def summary():
+    """Total time, calls, largest peak memory and explicit copies of every stage, slowest first."""
+    return records().groupby('name').agg(calls=('wall_seconds', 'size'), wall_seconds=('wall_seconds', 'sum'),
+                                         cpu_seconds=('cpu_seconds', 'sum'), peak_bytes=('peak_bytes', 'max'),
+                                         explicit_copies=('explicit_copies', 'sum')).sort_values('wall_seconds', ascending=False)
+
+
+def flame_summary():
+    """
+    Folded stacks of the recorded stages, one 'outer;inner microseconds' line per stack with the
+    time spent in it outside its child stages, as read by flamegraph.pl and speedscope.
+    """
+    df = records()
+    if df.empty:
+        return ''
+    total = df.groupby('path')['wall_seconds'].sum()
+    parents = total.index.str.rsplit(';', n=1).str[0]
+    children = total[total.index.str.contains(';')].groupby(parents[total.index.str.contains(';')]).sum()
+    self_time = (total - children.reindex(total.index, fill_value=0)).clip(lower=0)
+    return '\n'.join(f'{path} {int(round(seconds * 1e6))}' for path, seconds in self_time.items())
+
+
+def export(path, flame_path=None):
+    """
+    Write the records and summary as JSON, to compare runs and track regressions.
+
+    Parameters:
+    - path: str, JSON file to write
+    - flame_path: str, file to write the folded stacks from flame_summary to
+    """
+    report = {'records': records().to_dict(orient='records'),
+              'summary': summary().reset_index().to_dict(orient='records')}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+    if flame_path:
+        with open(flame_path, 'w') as f:
+            f.write(flame_summary() + '\n')
+
+
+if os.environ.get('WTB_PROFILE') == '1':
+    enable()
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import tempfile
+
+import joblib
+import numpy as np
+
+META_FILE = 'forest.json'
+NODE_ARRAYS = ['feature', 'threshold', 'children', 'value', 'missing_left', 'is_leaf']
+
+
+def _breadth_first(tree):
+    """Node ids of a tree in breadth first order, in which the two children of every split are next to each other."""
+    order, position = [0], 0
+    while position < len(order):
+        node = order[position]
+        position += 1
+        if tree.children_left[node] != -1:
+            order.extend([tree.children_left[node], tree.children_right[node]])
+    return np.asarray(order, dtype=np.int64)
+
+
+def _float32_thresholds(threshold):
+    """Largest float32 at or below each threshold, so `x <= threshold` is the same test for float32 inputs."""
+    rounded = threshold.astype(np.float32)
+    return np.where(rounded > threshold, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+
+def export_forest(model, path):
+    """
+    Flatten a fitted RandomForestRegressor into array-backed node tables.
+
+    All trees are stored back to back in one table per node attribute, each tree in breadth first
+    order so the right child of a split directly follows its left child and `children` holds only
+    the left one. Leaves point to themselves and never go right (threshold +inf, missing values go
+    left), so walking every tree a fixed number of steps ends on each tree's leaf. Thresholds are
+    stored as float32, rounded down so the comparisons match scikit-learn's float32 inputs exactly.
+
+    Parameters:
+    - model: fitted single output RandomForestRegressor
+    - path: str, directory to write the tables to
+    """
+    trees = [estimator.tree_ for estimator in model.estimators_]
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+    tables = {name: [] for name in NODE_ARRAYS}
+    for offset, tree in zip(offsets, trees):
+        order = _breadth_first(tree)
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+        is_leaf = tree.children_left[order] == -1
+        missing_left = np.asarray(getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8)), dtype=bool)
+        tables['feature'].append(np.where(is_leaf, 0, tree.feature[order]).astype(np.int32))
+        tables['threshold'].append(np.where(is_leaf, np.float32(np.inf), _float32_thresholds(tree.threshold[order])))
+        tables['children'].append((np.where(is_leaf, np.arange(len(order)), position[tree.children_left[order]]) + offset).astype(np.int32))
+        tables['value'].append(tree.value[order, 0, 0].astype(np.float64))
+        tables['missing_left'].append(missing_left[order] | is_leaf)
+        tables['is_leaf'].append(is_leaf)
+
+    os.makedirs(path, exist_ok=True)
+    for name, table in tables.items():
+        np.save(os.path.join(path, f'{name}.npy'), np.concatenate(table))
+    np.save(os.path.join(path, 'roots.npy'), offsets[:-1].astype(np.int32))
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({'n_trees': len(trees), 'n_features': int(model.n_features_in_),
+                   'max_depth': int(max(tree.max_depth for tree in trees)),
+                   # Without a split sending missing values right, comparing NaN (always false) already goes left
+                   'missing_right': bool(not np.all(np.concatenate(tables['missing_left'])))}, f)
+
+
+class compiled_forest():
+    def __init__(self, path, mmap_mode='r'):
+        """
+        Random forest exported with export_forest, evaluated for many rows and trees at once.
+
+        Every table is used as stored, so with `mmap_mode` loading only maps the files.
+
+        Parameters:
+        - path: str, directory the forest was exported to
+        - mmap_mode: str, numpy memmap mode, None loads the tables into memory
+        """
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        for name in NODE_ARRAYS + ['roots']:
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode))
+
+    def predict_trees(self, X, tree_batch=16, check_every=6):
+        """
+        Prediction of every tree for every row.
+
+        Each step moves every (row, tree) path one level down with a handful of vectorized
+        lookups. Trees are walked a block of `tree_batch` at a time so the nodes being read stay
+        in cache, and every `check_every` levels the paths that reached a leaf are dropped, so
+        deep trees only cost work for the paths that are still going.
+
+        Parameters:
+        - X: array-like of shape (n_rows, n_features)
+        - tree_batch: int, trees evaluated together
+        - check_every: int, levels walked between removing finished paths
+
+        Returns:
+        Array of shape (n_rows, n_trees).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        values = X.ravel()
+        out = np.empty((n_rows, self.meta['n_trees']), dtype=np.float64)
+        for start in range(0, self.meta['n_trees'], tree_batch):
+            roots = self.roots[start:start + tree_batch]
+            leaves = np.empty(n_rows * len(roots), dtype=np.float64)
+            paths = np.arange(len(leaves))
+            offsets = np.repeat(np.arange(n_rows, dtype=np.int32) * np.int32(n_features), len(roots))
+            nodes = np.tile(roots, n_rows)
+            for depth in range(1, self.meta['max_depth'] + 1):
+                x = values.take(offsets + self.feature.take(nodes))
+                go_right = x > self.threshold.take(nodes)
+                if self.meta['missing_right']:
+                    go_right |= np.isnan(x) & ~self.missing_left.take(nodes)
+                nodes = self.children.take(nodes) + go_right
+                if depth % check_every == 0:
+                    done = self.is_leaf.take(nodes)
+                    leaves[paths[done]] = self.value.take(nodes[done])
+                    running = ~done
+                    nodes, paths, offsets = nodes[running], paths[running], offsets[running]
+                    if not len(nodes):
+                        break
+            leaves[paths] = self.value.take(nodes)
+            out[:, start:start + len(roots)] = leaves.reshape(n_rows, len(roots))
+        return out
+
+    def predict(self, X):
+        """
+        Get the forest's predictions, the mean of its trees.
+
+        Parameters:
+        - X: array-like of shape (n_rows, n_features)
+
+        Returns:
+        Numpy array of predictions.
+        """
+        return self.predict_trees(X).mean(axis=1)
+
+
+def compare_with_sklearn(model, X, repeats=3):
+    """
+    Benchmark the compiled forest against the scikit-learn model it was exported from.
+
+    Parameters:
+    - model: fitted RandomForestRegressor
+    - X: array-like of rows to score
+    - repeats: int, timing repeats, the best time is reported
+
+    Returns:
+    Dict with artifact sizes, load and predict seconds for both, and the largest prediction difference.
+    """
+    def best_time(func):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    X = np.asarray(X, dtype=np.float32)
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_file = os.path.join(tmp, 'model.joblib')
+        forest_dir = os.path.join(tmp, 'forest')
+        joblib.dump(model, pickle_file)
+        export_forest(model, forest_dir)
+
+        sklearn_load, loaded = best_time(lambda: joblib.load(pickle_file))
+        compiled_load, forest = best_time(lambda: compiled_forest(forest_dir))
+        sklearn_predict, expected = best_time(lambda: loaded.predict(X))
+        compiled_predict, predictions = best_time(lambda: forest.predict(X))
+        return {
+            'sklearn_bytes': os.path.getsize(pickle_file),
+            'compiled_bytes': sum(os.path.getsize(os.path.join(forest_dir, f)) for f in os.listdir(forest_dir)),
+            'sklearn_load_seconds': sklearn_load,
+            'compiled_load_seconds': compiled_load,
+            'sklearn_predict_seconds': sklearn_predict,
+            'compiled_predict_seconds': compiled_predict,
+            'max_abs_difference': float(np.max(np.abs(expected - predictions))),
+        }
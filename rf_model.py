@@ -1,72 +1,55 @@
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error, mean_absolute_error
 import numpy as np
 import matplotlib.pyplot as plt
-import joblib
 
+import rf_compiled
+import profiling
+from feature_matrix import feature_matrix
+from xp_model import base_xp_model
 
-class rf_xp_model():
-    def __init__(self, max_depth=20, max_features='auto', min_samples_leaf=2, min_samples_split=2, n_estimators=500):
+
+class rf_xp_model(base_xp_model):
+    def __init__(self, max_depth=20, max_features=1.0, min_samples_leaf=2, min_samples_split=2, n_estimators=500,
+                 n_jobs=-1, random_state=None):
+        # 'auto' was removed from scikit-learn, for regressors it always meant every feature
+        if max_features == 'auto':
+            max_features = 1.0
         self.model = RandomForestRegressor(max_depth=max_depth, max_features=max_features, 
                                            min_samples_leaf=min_samples_leaf, min_samples_split=min_samples_split, 
-                                           n_estimators = n_estimators)
+                                           n_estimators = n_estimators, n_jobs=n_jobs, random_state=random_state)
 
-    def train_model(self, X, y):
-        """
-        Trains the RF model.
-        
-        Parameters:
-        - X: Feature DataFrame
-        - y: Target DataFrame
+    @profiling.profiled
+    def predict_trees(self, X):
         """
-        X_train, X_valid, y_train, y_valid = train_test_split(X, y, test_size=0.2, random_state=42)
-        self.model.fit(X_train.drop(columns=['name', 'kickoff_time']), y_train)
-
-        predictions = self.model.predict(X_valid.drop(columns=['name', 'kickoff_time']))
-        mse = mean_squared_error(y_valid, predictions)
-        mae = mean_absolute_error(y_valid, predictions)
-
-        print(f'Mean Squared Error: {mse}')
-        print(f'Mean Absolute Error: {mae}')
+        Get the prediction of every tree of the forest, the spread of which shows how sure the
+        forest is about each row.
 
-    def predict(self, X):
-        """
-        Get model's predictions given input data.
-        
         Parameters:
-        - X: Input data DataFrame
-        
-        Returns:
-        Numpy array of predictions.
-        """
-        return self.model.predict(X)
+        - X: Input data DataFrame, array, or feature_matrix (every row is scored)
 
-    def save_model(self, file_name):
-        """
-        Saves the model to a file.
-        
-        Parameters:
-        - file_name: str, path to save the model
-        """
-        joblib.dump(self.model, file_name)
-        print(f'Model saved as {file_name}')
-        
-    def load_model(self, file_name):
-        """
-        Loads the model from a file.
+        Returns:
+        Numpy array of shape (n_rows, n_trees).
+        """
+        if isinstance(X, feature_matrix):
+            X = X.X
+        X = self._matrix(X)
+        # The trees were fitted on the array the forest converted its input to
+        X = X.to_numpy(dtype=np.float32) if hasattr(X, 'to_numpy') else X
+        # Leaf of every row in every tree from the forest's parallel traversal, then one gather of
+        # the leaf values of all trees stored back to back
+        leaves = self.model.apply(X)
+        trees = [estimator.tree_ for estimator in self.model.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees[:-1]])
+        values = np.concatenate([tree.value[:, 0, 0] for tree in trees])
+        return values[leaves + offsets]
+
+    def export_compiled(self, path):
+        """
+        Exports the fitted forest as array-backed node tables for rf_compiled.compiled_forest,
+        which loads (memory-mapped) much faster than the joblib pickle and scores a gameweek of rows faster.
         
         Parameters:
-        - file_name: str, path to load the model from
-        """
-        self.model = joblib.load(file_name)
-        print(f'Model loaded from {file_name}')
-
-    def add_predictions_to_daata(self, X):
-        """
-        Generates the predictions and adds it to the Expected points column
-            ['xP'] as the predictions
+        - path: str, directory to export the forest to
         """
-        preds = self.predict(X)
-        X['xP'] = preds
-        return X 
+        rf_compiled.export_forest(self.model, path)
+        print(f'Model exported to {path}')
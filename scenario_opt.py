@@ -0,0 +1,125 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pulp
+
+import schema
+import team_opt
+
+# Selection arrays filled in by _init_worker in every worker process
+_shared = {}
+
+
+def draw_scenarios(tree_xp, n_scenarios=100, seed=None):
+    """
+    Draw xP scenarios from the per-tree predictions of a forest.
+
+    Every scenario picks one of the forest's trees at random and every player scores that tree's
+    prediction, so a scenario keeps the joint structure of the players' xP within a tree. All
+    draws are made in a single gather.
+
+    Parameters:
+    - tree_xp: array of shape (n_players, n_trees), such as rf_xp_model.predict_trees or
+        rf_compiled.compiled_forest.predict_trees
+    - n_scenarios: int, number of scenarios
+    - seed: int, seed of the random tree picks
+
+    Returns:
+    Array of shape (n_scenarios, n_players).
+    """
+    tree_xp = np.asarray(tree_xp, dtype=float)
+    n_players, n_trees = tree_xp.shape
+    rng = np.random.default_rng(seed)
+    trees = rng.integers(0, n_trees, size=n_scenarios)
+    return tree_xp[:, trees].T
+
+
+def _init_worker(value, position_codes, team_codes, budget):
+    _shared.update(value=value, position_codes=position_codes, team_codes=team_codes, budget=budget)
+
+
+def _solve_chunk(scenarios):
+    """
+    Solve the selection of every scenario in a chunk.
+
+    Returns:
+    int8 array of shape (n_scenarios, n_players), 2 for starters, 1 for substitutes and 0 otherwise.
+    """
+    solver = pulp.PULP_CBC_CMD(msg=False)
+    picks = np.zeros(scenarios.shape, dtype=np.int8)
+    for k, xp in enumerate(scenarios):
+        starting_11, substitutes = team_opt.solve_selection(xp, _shared['value'], _shared['position_codes'],
+                                                            _shared['team_codes'], _shared['budget'], solver=solver)
+        picks[k, starting_11] = 2
+        picks[k, substitutes] = 1
+    return picks
+
+
+def solve_scenarios(scenarios, value, position_codes, team_codes, budget=100, max_workers=None):
+    """
+    Solve team_opt.solve_selection for every scenario in a process pool.
+
+    The player arrays are sent to every worker once and the scenarios in chunks, so throughput
+    grows with the number of cores.
+
+    Parameters:
+    - scenarios: array of shape (n_scenarios, n_players), see draw_scenarios
+    - value, position_codes, team_codes, budget: as in team_opt.solve_selection
+    - max_workers: int, number of worker processes, defaults to the number of cores
+
+    Returns:
+    int8 array of shape (n_scenarios, n_players), 2 for starters, 1 for substitutes and 0 otherwise.
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, len(scenarios))
+    shared = (np.asarray(value, dtype=float), np.asarray(position_codes), np.asarray(team_codes), budget)
+    if max_workers <= 1:
+        _init_worker(*shared)
+        return _solve_chunk(scenarios)
+    # A few chunks per worker keeps every core busy when some scenarios take longer to solve
+    chunks = np.array_split(scenarios, min(len(scenarios), 4 * max_workers))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=shared) as executor:
+        return np.concatenate(list(executor.map(_solve_chunk, chunks)))
+
+
+def select_team_scenarios(data, tree_xp, n_scenarios=100, risk_aversion=1.0, budget=100, max_workers=None, seed=None):
+    """
+    Robust team selection over xP scenarios drawn from a forest's per-tree predictions.
+
+    Every scenario is solved with team_opt.solve_selection. The risk adjusted team is then
+    selected on the mean minus `risk_aversion` standard deviations of each player's xP over the
+    trees, so players the forest is unsure about need a higher xP to be picked.
+
+    Parameters:
+    - data: player DataFrame as taken by team_opt.select_team, `xP` is not needed
+    - tree_xp: array of shape (len(data), n_trees) with the prediction of every tree for every row
+    - n_scenarios: int, number of scenarios
+    - risk_aversion: float, standard deviations of xP taken off the mean, 0 picks on the mean alone
+    - budget: float, most the 15 players can cost, in the units of `value`
+    - max_workers: int, number of worker processes, defaults to the number of cores
+    - seed: int, seed of the scenario draws
+
+    Returns:
+    Tuple of a DataFrame, indexed like `data`, with every player's xP mean and standard deviation
+    over the trees and the fraction of scenarios it was selected and started in, and the risk adjusted selection
+    as a tuple of lists with the index labels of the starting 11 and of the substitutes.
+    """
+    position_codes = team_opt._codes(data, 'position', [f'position_{position}' for position in schema.POSITIONS], schema.POSITIONS)
+    team_codes = team_opt._codes(data, 'team', [col for col in data.columns if col.startswith('team_') and col not in team_opt.TEAM_STAT_COLUMNS])
+    value = data['value'].to_numpy(dtype=float)
+    tree_xp = np.asarray(tree_xp, dtype=float)
+
+    scenarios = draw_scenarios(tree_xp, n_scenarios, seed)
+    picks = solve_scenarios(scenarios, value, position_codes, team_codes, budget, max_workers)
+    frequencies = pd.DataFrame({
+        'xP_mean': tree_xp.mean(axis=1),
+        'xP_std': tree_xp.std(axis=1),
+        'selected': (picks > 0).mean(axis=0),
+        'started': (picks == 2).mean(axis=0),
+    }, index=data.index)
+
+    risk_adjusted = frequencies['xP_mean'] - risk_aversion * frequencies['xP_std']
+    starting_11, substitutes = team_opt.solve_selection(risk_adjusted.to_numpy(), value, position_codes, team_codes, budget,
+                                                        solver=pulp.PULP_CBC_CMD(msg=False))
+    return frequencies, (data.index[starting_11].tolist(), data.index[substitutes].tolist())
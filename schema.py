@@ -0,0 +1,90 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import scipy.sparse
+
+POSITIONS = ['GK', 'DEF', 'MID', 'FWD']
+
+# Largest integer a float32 holds exactly
+_FLOAT32_EXACT = 2 ** 24
+
+# Integer stats summed over a player's history, such as the season points in feature_utils.get_avg_ppg.
+#  They are kept at int32 or wider so the running sums cannot overflow.
+ACCUMULATED_COLUMNS = ['total_points', 'minutes', 'bps', 'bonus', 'goals_scored', 'assists']
+
+
+def team_vocabulary(fixtures):
+    """Sorted names of every team in the fixture data, shared by all seasons so encodings line up."""
+    return sorted(set(fixtures['team_name'].dropna()) | set(fixtures['opponent_name'].dropna()))
+
+
+def _categories(values, vocabulary=None):
+    """Vocabulary plus any values missing from it, sorted so sorting by the column is unchanged."""
+    return sorted(set(pd.Series(values).dropna().unique()) | set(vocabulary or []))
+
+
+def _downcast(series, min_integer=np.int8):
+    """Smallest dtype, and for integers no smaller than `min_integer`, that holds every value of a numeric column exactly."""
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        series = pd.to_numeric(series, downcast='integer')
+        return series.astype(min_integer) if series.dtype.itemsize < np.dtype(min_integer).itemsize else series
+    values = series.to_numpy()
+    finite = values[~np.isnan(values)]
+    if np.array_equal(finite, np.round(finite)) and np.all(np.abs(finite) < _FLOAT32_EXACT):
+        return series.astype(np.float32)
+    return series
+
+
+def compact_player_frame(df, teams=None, seasons=None):
+    """
+    Store the master player frame in a compact layout.
+
+    String columns become categoricals and numeric stats are downcast to the smallest dtype that
+    holds every value exactly (integer valued float columns such as scores become float32).
+    Integer ACCUMULATED_COLUMNS stay at int32 or wider.
+    Categories are sorted, so sorting and grouping give the same order as with plain strings.
+
+    Parameters:
+    - df: player DataFrame
+    - teams: list of team names shared across seasons, see team_vocabulary
+    - seasons: list of seasons shared across frames
+
+    Returns:
+    Compacted DataFrame.
+    """
+    df = df.copy(deep=False)
+    vocabularies = {'name': None, 'team': teams, 'opponent_team_name': teams,
+                    'season': sorted(seasons) if seasons else None, 'position': POSITIONS}
+    for col, vocabulary in vocabularies.items():
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = pd.Categorical(df[col], categories=_categories(df[col], vocabulary))
+    for col in df.columns:
+        if col not in vocabularies:
+            df[col] = _downcast(df[col], np.int32 if col in ACCUMULATED_COLUMNS else np.int8)
+    return df
+
+
+def model_matrix(X):
+    """
+    Matrix to pass to scikit-learn for a feature frame.
+
+    Frames with sparse columns, such as the one-hot encodings from
+    feature_utils.encode_teams(sparse=True), become a CSR matrix with the columns in the same
+    order so the one-hots are never densified. Other frames, and arrays, are returned unchanged.
+    """
+    if not isinstance(X, pd.DataFrame):
+        return X
+    is_sparse = [isinstance(dtype, pd.SparseDtype) for dtype in X.dtypes]
+    if not any(is_sparse):
+        return X
+    blocks = []
+    for sparse_block, run in itertools.groupby(zip(X.columns, is_sparse), key=lambda col: col[1]):
+        cols = [col for col, _ in run]
+        if sparse_block:
+            blocks.append(X[cols].sparse.to_coo().astype(np.float32))
+        else:
+            blocks.append(scipy.sparse.csr_matrix(X[cols].to_numpy(dtype=np.float32)))
+    return scipy.sparse.hstack(blocks, format='csr')
@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# Fixes every season gets, SEASON_SCHEMA entries override them per season
+DEFAULT_SCHEMA = {
+    # Number of gameweek files in gws/
+    'gameweek_files': 38,
+    # Gameweek file number: gameweek it holds
+    'gameweek_remap': {},
+    # Column name in the season's files: column name in the other seasons
+    'renames': {},
+    # Position spelling in the season's files: position
+    'position_aliases': {'GKP': 'GK'},
+    # (regex, replacement) pairs turning the season's player names into the names of the other seasons
+    'name_replacements': [],
+    # Player frame column: fixture column it is recovered from when missing, joined on the fixture and home/away
+    'recover_from_fixtures': {},
+    # Fill missing positions with the player's latest position in another season
+    'fill_positions': False,
+}
+
+# Seasons whose files differ from the others. A new season with different files only needs an entry here.
+SEASON_SCHEMA = {
+    '2019-20': {
+        # The season was paused, the files for gameweeks 30 to 38 are numbered 39 to 47
+        'gameweek_files': 47,
+        'gameweek_remap': {gw: gw - 9 for gw in range(39, 48)},
+        # Names are stored as First_Last_element
+        'name_replacements': [(r'_\d+$', ''), ('_', ' ')],
+        # The files have no team or position columns
+        'recover_from_fixtures': {'team': 'team_name', 'difficulty': 'difficulty',
+                                  'opponent_difficulty': 'opponent_difficulty', 'score': 'score',
+                                  'opponent_score': 'opponent_score'},
+        'fill_positions': True,
+    },
+}
+
+
+def season_config(season):
+    """Fixes of a season, the defaults updated with its SEASON_SCHEMA entry."""
+    return {**DEFAULT_SCHEMA, **SEASON_SCHEMA.get(season, {})}
+
+
+def gameweek_files(season):
+    """Number of gameweek files of a season."""
+    return season_config(season)['gameweek_files']
+
+
+def gameweek_number(season, gw_file):
+    """Gameweek held by gameweek file `gw_file` of a season."""
+    return season_config(season)['gameweek_remap'].get(gw_file, gw_file)
+
+
+def _season_codes(df):
+    """Code of every row's season (-1 when missing) and the sorted seasons, so later steps compare integers."""
+    codes, seasons = pd.factorize(df['season'], sort=True)
+    return codes, list(seasons)
+
+
+def _seasons_with(season_codes, key):
+    """Codes of the seasons whose config sets `key` and the rows of those seasons."""
+    codes, seasons = season_codes
+    selected = [code for code, season in enumerate(seasons) if season_config(season)[key]]
+    return selected, np.flatnonzero(np.isin(codes, selected)) if selected else None
+
+
+def _fix_values(df, column, key, fix, season_codes):
+    """
+    Fix a column in the seasons whose config sets `key`. The fix runs once per unique
+    (season, value) pair and is mapped back to the rows through the pair codes.
+
+    Parameters:
+    - df: player DataFrame
+    - column: str, column to fix
+    - key: str, SEASON_SCHEMA key of the fix
+    - fix: function of (setting, values) returning the fixed values
+    - season_codes: tuple from _season_codes
+    """
+    selected, rows = _seasons_with(season_codes, key)
+    if not selected:
+        return df
+    codes, seasons = season_codes
+    value_codes, values = pd.factorize(df[column].to_numpy()[rows], use_na_sentinel=False)
+    pair_codes, pairs = pd.factorize(codes[rows].astype(np.int64) * len(values) + value_codes)
+    pairs = pd.DataFrame({'season': pairs // len(values), column: values[pairs % len(values)]})
+    fixed = pairs[column].copy()
+    for code, group in pairs.groupby('season', sort=False):
+        fixed[group.index] = fix(season_config(seasons[code])[key], group[column])
+    values = df[column].to_numpy(copy=True)
+    values[rows] = fixed.to_numpy()[pair_codes]
+    df[column] = values
+    return df
+
+
+def _replace_names(replacements, names):
+    # Missing names stay missing instead of becoming 'nan'
+    names = names.astype(str).where(names.notna())
+    for pattern, replacement in replacements:
+        names = names.str.replace(pattern, replacement, regex=True)
+    return names
+
+
+def _replace_values(mapping, values):
+    return values.replace(mapping)
+
+
+def _rename_columns(df, season_codes):
+    """Move the values of each season's renamed columns to the name the other seasons use."""
+    codes, seasons = season_codes
+    for code, season in enumerate(seasons):
+        renames = {old: new for old, new in season_config(season)['renames'].items() if old in df.columns}
+        if not renames:
+            continue
+        in_season = codes == code
+        for old, new in renames.items():
+            df[new] = np.where(in_season, df[old], df[new]) if new in df.columns else df[old].where(in_season)
+        df = df.drop(columns=list(renames))
+    return df
+
+
+def recover_from_fixtures(df, fixture_data, season_codes=None):
+    """
+    Fill columns the files of some seasons lack, such as the team, from the fixture each row was
+    played in, seen from the player's side (home or away).
+
+    The rows are joined to the fixtures on (season, fixture, was_home) in one lookup.
+
+    Parameters:
+    - df: player DataFrame
+    - fixture_data: DataFrame from fetch_data.get_all_fixture_df
+    - season_codes: tuple from _season_codes, computed when not given
+    """
+    season_codes = season_codes or _season_codes(df)
+    selected, rows = _seasons_with(season_codes, 'recover_from_fixtures')
+    if not selected:
+        return df
+    codes, seasons = season_codes
+    fixtures = fixture_data[fixture_data['season'].isin([seasons[code] for code in selected])]
+    keys = pd.MultiIndex.from_arrays([pd.Categorical(fixtures['season'], categories=seasons).codes, fixtures['id'],
+                                      fixtures['was_home'].astype(bool)])
+    found = keys.get_indexer(pd.MultiIndex.from_arrays([codes[rows], df['fixture'].to_numpy()[rows],
+                                                        df['was_home'].to_numpy()[rows].astype(bool)]))
+    rows, found = rows[found >= 0], found[found >= 0]
+
+    columns = {column: source for code in selected for column, source in season_config(seasons[code])['recover_from_fixtures'].items()}
+    for column, source in columns.items():
+        # Only rows of the seasons recovering this column, and only where it is missing
+        recovering = np.isin(codes[rows], [code for code in selected if column in season_config(seasons[code])['recover_from_fixtures']])
+        recovered = fixtures[source].to_numpy()[found[recovering]]
+        values = df[column].to_numpy(copy=True) if column in df.columns else np.full(len(df), np.nan, dtype=object)
+        if values.dtype != object and recovered.dtype == object:
+            values = values.astype(object)
+        missing = pd.isna(values[rows[recovering]])
+        values[rows[recovering][missing]] = recovered[missing]
+        df[column] = values
+    return df
+
+
+def fill_positions(df, season_codes=None):
+    """
+    Fill the missing positions of seasons with `fill_positions` from the player's latest position
+    in another season, and drop rows whose position is still unknown, which belong to players who
+    are not playing any more.
+
+    Parameters:
+    - df: player DataFrame with seasons and gameweeks
+    - season_codes: tuple from _season_codes, computed when not given
+    """
+    season_codes = season_codes or _season_codes(df)
+    selected, fill_rows = _seasons_with(season_codes, 'fill_positions')
+    position = df['position'].to_numpy(dtype=object, copy=True)
+    known = pd.notna(position)
+    if selected:
+        codes = season_codes[0]
+        rows = np.flatnonzero(known & ~np.isin(codes, selected))
+        # Latest row of every player with a known position, by season (codes are in season order) and then gameweek
+        order = codes.astype(np.int64) * 64 + df['gameweek'].to_numpy()
+        name_codes, names = pd.factorize(df['name'].to_numpy()[rows])
+        by_player = np.lexsort((order[rows], name_codes))
+        last = by_player[np.r_[name_codes[by_player][1:] != name_codes[by_player][:-1], True]] if len(rows) else rows
+        latest_position = pd.Series(position[rows[last]], index=names[name_codes[last]])
+
+        fill = fill_rows[~known[fill_rows]]
+        position[fill] = pd.Series(df['name'].to_numpy()[fill]).map(latest_position).to_numpy()
+        known = pd.notna(position)
+        df['position'] = position
+    return df if known.all() else df[known]
+
+
+def fix_positions(df, season_codes=None):
+    """
+    Make the position spellings of every season match and fill the missing positions, see
+    fill_positions. Other columns are left as they are.
+
+    Parameters:
+    - df: player DataFrame with seasons and gameweeks
+    - season_codes: tuple from _season_codes, computed when not given
+    """
+    season_codes = season_codes or _season_codes(df)
+    df = df.copy(deep=False)
+    if 'position' not in df.columns:
+        df['position'] = pd.Series(np.nan, index=df.index, dtype=object)
+    df = _fix_values(df, 'position', 'position_aliases', _replace_values, season_codes)
+    return fill_positions(df, season_codes)
+
+
+@profiling.profiled
+def normalize_seasons(df, fixture_data=None):
+    """
+    Apply the fixes of SEASON_SCHEMA to a player frame holding any mix of seasons.
+
+    Fixes are applied once per unique (season, value) pair or as one fixture join, not per row:
+    renamed columns are moved, player names and position spellings made to match the other seasons,
+    missing columns recovered from the fixtures and missing positions filled from the player's other
+    seasons. Rows whose position is still unknown are dropped. Gameweek file numbers are remapped
+    when the files are read, in fetch_data.get_gws.
+
+    Parameters:
+    - df: player DataFrame
+    - fixture_data: DataFrame from fetch_data.get_all_fixture_df, needed for seasons recovering
+        columns from the fixtures
+
+    Returns:
+    Normalized DataFrame.
+    """
+    season_codes = _season_codes(df)
+    df = _rename_columns(df.copy(deep=False), season_codes)
+    df = _fix_values(df, 'name', 'name_replacements', _replace_names, season_codes)
+    if fixture_data is not None:
+        df = recover_from_fixtures(df, fixture_data, season_codes)
+    return fix_positions(df, season_codes)
@@ -1,77 +1,179 @@
-import requests
 import pulp
-
-def fetch_fpl_team(self):
-    """Fetch an FPL team's starting 11 and bench players given a team ID."""
-    url = f"https://fantasy.premierleague.com/api/my-team/{self.team_id}/"
-    response = requests.get(url)
-
-    if response.status_code == 200:
-        team_data = response.json()
-        starting_11 = [player['element'] for player in team_data['picks'] if player['position'] <= 11]
-        bench = [player['element'] for player in team_data['picks'] if player['position'] > 11]
-        return {
-            'starting_11': starting_11,
-            'bench': bench
-        }
-    else:
-        print(f"Error {response.status_code}: {response.text}")
-        return None
-
-def select_team(data):
-    # Create a linear optimization problem
-    prob = pulp.LpProblem('FPLTeamSelection', pulp.LpMaximize)
-
-    # Create decision variables
-    x = pulp.LpVariable.dicts('player_in_11', data.index, cat='Binary')
-    s = pulp.LpVariable.dicts('player_as_sub', data.index, cat='Binary')
-
-    # Objective function
-    prob += pulp.lpSum(data['xP'] * x[i] for i in data.index) + pulp.lpSum(data['xP'] * s[i] for i in data.index)
-
-    # Constraints
-    prob += pulp.lpSum(x[i] for i in data.index) == 11
-    prob += pulp.lpSum(s[i] for i in data.index) == 4
-
-    # Positional constraints for starting lineup (adjust as needed)
-    prob += pulp.lpSum(x[i] for i in data[data['position_GK'] == 1].index) == 1
-    prob += pulp.lpSum(x[i] for i in data[data['position_DEF'] == 1].index) >= 3
-    prob += pulp.lpSum(x[i] for i in data[data['position_DEF'] == 1].index) <= 5
-    prob += pulp.lpSum(x[i] for i in data[data['position_MID'] == 1].index) >= 3
-    prob += pulp.lpSum(x[i] for i in data[data['position_MID'] == 1].index) <= 5
-    prob += pulp.lpSum(x[i] for i in data[data['position_FWD'] == 1].index) >= 1
-    prob += pulp.lpSum(x[i] for i in data[data['position_FWD'] == 1].index) <= 3
-
-    # Player can't be both in the starting lineup and a substitute
-    for i in data.index:
-        prob += x[i] + s[i] <= 1
-
-    # Budget constraint
-    total_budget = 100  # in millions
-    prob += pulp.lpSum(data['value'] * x[i] for i in data.index) + pulp.lpSum(data['value'] * s[i] for i in data.index) <= total_budget
-
-    # Maximum 3 players from a single team constraint
-    # TODO Replace team names with actual team names when data inference is done.
-    teams = ['arsenal', 'aston', 'bournemouth', 'brentford', 'brighton', 'brom', 'burnley',
-         'chelsea', 'city', 'crystal', 'everton', 'forest', 'fulham', 'ham', 'leeds',
-         'leicester', 'liverpool', 'luton', 'man', 'newcastle', 'norwich', 'nott', 'palace',
-         'sheffield', 'southampton', 'spurs', 'utd', 'villa', 'watford', 'west', 'wolves']
-
-    for team in teams:
-        team_column = f'team_{team}'
-        prob += pulp.lpSum(x[i] for i in data[data[team_column] == 1].index) + \
-                pulp.lpSum(s[i] for i in data[data[team_column] == 1].index) <= 3
-
-    # teams = data['team'].unique()
-    # for team in teams:
-    #     prob += pulp.lpSum(x[i] for i in data[data['team'] == team].index) + pulp.lpSum(s[i] for i in data[data['team'] == team].index) <= 3
+import numpy as np
+import pandas as pd
+
+import fpl_api
+import schema
+import profiling
+
+def fetch_fpl_team(team_id, event=None, client=None):
+    """
+    Fetch an FPL team's starting 11 and bench players given a team ID.
+
+    Parameters:
+    - team_id: int, FPL manager (entry) id
+    - event: int, gameweek of the picks, defaults to the current one
+    - client: fpl_api.fpl_client to reuse its connections and cache, use its fetch_teams for many teams
+
+    Returns:
+    Dict with the element ids of the 'starting_11' and the 'bench', or None if the team was not found.
+    """
+    client = client or fpl_api.fpl_client()
+    team = client.fetch_team(team_id, event)
+    if team is None:
+        print(f"Team {team_id} not found")
+    return team
+
+# Fewest and most starters per position
+LINEUP_LIMITS = {'GK': (1, 1), 'DEF': (3, 5), 'MID': (3, 5), 'FWD': (1, 3)}
+N_STARTERS = 11
+N_SUBS = 4
+MAX_PER_TEAM = 3
+# Player data columns that start with 'team_' but are not one-hot team columns
+TEAM_STAT_COLUMNS = ['team_a_score', 'team_h_score']
+
+
+@profiling.profiled
+def _dominated(xp, value, position_codes, team_codes):
+    """
+    Players that can be dropped without changing the best selection.
+
+    Player j is dominated by i in the same position when i costs no more and scores at least as
+    much xP (ties broken by value, xP, then row). A selection holds at most the most starters of
+    the position plus every sub, and at most 15 / 3 = 5 teams can be full, so once j's dominators
+    come from more teams than that sum, one of them can always be swapped in for j without
+    breaking any constraint or lowering the objective.
+
+    Returns:
+    Boolean array, True for players that can be dropped.
+    """
+    dominated = np.zeros(len(xp), dtype=bool)
+    n_teams = team_codes.max() + 1 if len(team_codes) else 0
+    full_teams = (N_STARTERS + N_SUBS) // MAX_PER_TEAM
+    for position, name in enumerate(schema.POSITIONS):
+        most = LINEUP_LIMITS[name][1]
+        members = np.flatnonzero(position_codes == position)
+        order = members[np.lexsort((members, -xp[members], value[members]))]
+        # best[r, t]: highest xP of team t among the players ranked before r, i.e. the ones that cost
+        # no more than the player at rank r. Players without a team never count as dominators.
+        best = np.full((len(order) + 1, n_teams), -np.inf)
+        has_team = team_codes[order] >= 0
+        best[np.arange(1, len(order) + 1)[has_team], team_codes[order][has_team]] = xp[order][has_team]
+        best = np.fmax.accumulate(best, axis=0)[:-1]
+        dominating_teams = (best >= xp[order][:, None]).sum(axis=1)
+        dominated[order[dominating_teams >= most + N_SUBS + full_teams]] = True
+    return dominated
+
+
+@profiling.profiled
+def solve_selection(xp, value, position_codes, team_codes, budget=100, presolve=True, solver=None):
+    """
+    Select the starting 11 and substitutes with the highest total xP.
+
+    Parameters:
+    - xp: array of expected points
+    - value: array of player prices
+    - position_codes: int array, position in schema.POSITIONS
+    - team_codes: int array, players with the same code are limited to MAX_PER_TEAM, negative
+        codes are not limited
+    - budget: float, most the 15 players can cost, in the units of `value`
+    - presolve: bool, drop dominated players before building the problem
+    - solver: pulp solver, defaults to pulp's default solver
+
+    Returns:
+    Tuple of arrays with the row positions of the starting 11 and of the substitutes.
+    """
+    xp = np.asarray(xp, dtype=float)
+    value = np.asarray(value, dtype=float)
+    position_codes = np.asarray(position_codes, dtype=np.int64)
+    team_codes = np.asarray(team_codes, dtype=np.int64)
+    rows = np.flatnonzero(~_dominated(xp, value, position_codes, team_codes)) if presolve else np.arange(len(xp))
+
+    with profiling.stage('team_opt.lp_build', xp[rows]):
+        # Create a linear optimization problem
+        prob = pulp.LpProblem('FPLTeamSelection', pulp.LpMaximize)
+
+        # Create decision variables
+        x = [pulp.LpVariable(f'player_in_11_{i}', cat='Binary') for i in rows]
+        s = [pulp.LpVariable(f'player_as_sub_{i}', cat='Binary') for i in rows]
+
+        def total(variables, coefficients=None):
+            coefficients = np.ones(len(variables)) if coefficients is None else coefficients
+            return pulp.LpAffineExpression(zip(variables, coefficients.tolist()))
+
+        # Objective function
+        prob += total(x + s, np.concatenate([xp[rows], xp[rows]]))
+
+        # Constraints
+        prob += total(x) == N_STARTERS
+        prob += total(s) == N_SUBS
+
+        # Positional constraints for starting lineup
+        for position, name in enumerate(schema.POSITIONS):
+            fewest, most = LINEUP_LIMITS[name]
+            players = np.flatnonzero(position_codes[rows] == position)
+            starters = total([x[j] for j in players])
+            if fewest == most:
+                prob += starters == fewest
+            else:
+                prob += starters >= fewest
+                prob += starters <= most
+
+        # Player can't be both in the starting lineup and a substitute
+        for x_i, s_i in zip(x, s):
+            prob += x_i + s_i <= 1
+
+        # Budget constraint
+        prob += total(x + s, np.concatenate([value[rows], value[rows]])) <= budget
+
+        # Maximum 3 players from a single team constraint, one pass over the players grouped by team
+        order = np.argsort(team_codes[rows], kind='stable')
+        codes = team_codes[rows][order]
+        for players in np.split(order, np.flatnonzero(np.diff(codes)) + 1):
+            if len(players) > MAX_PER_TEAM and team_codes[rows[players[0]]] >= 0:
+                prob += total([x[j] for j in players] + [s[j] for j in players]) <= MAX_PER_TEAM
 
     # Solve the problem
-    prob.solve()
+    with profiling.stage('team_opt.lp_solve'):
+        prob.solve(solver)
 
     # Extract selected players for starting 11 and substitutes
-    starting_11 = [i for i in data.index if x[i].value() == 1]
-    substitutes = [i for i in data.index if s[i].value() == 1]
-
+    starting_11 = rows[[j for j, x_i in enumerate(x) if x_i.value() > 0.5]]
+    substitutes = rows[[j for j, s_i in enumerate(s) if s_i.value() > 0.5]]
     return starting_11, substitutes
 
+
+def _codes(data, column, dummy_columns, categories=None):
+    """Integer codes of a column of `data`, or of its one-hot `dummy_columns`, -1 when missing."""
+    if f'{column}_code' in data.columns:
+        return data[f'{column}_code'].to_numpy()
+    if column in data.columns:
+        return pd.Categorical(data[column], categories=categories).codes
+    dummies = data[dummy_columns].to_numpy(dtype=float)
+    return np.where(dummies.any(axis=1), dummies.argmax(axis=1), -1)
+
+
+@profiling.profiled
+def select_team(data, budget=100, presolve=True, solver=None):
+    """
+    Select the starting 11 and substitutes with the highest total xP.
+
+    Positions and teams are taken from the integer `position_code` and `team_code` columns
+    (feature_utils.encode_positions / encode_teams with codes=True) when present, else from
+    `position` and `team` columns or their one-hot `position_*` and `team_*` columns.
+
+    Parameters:
+    - data: player DataFrame with `xP` and `value` columns
+    - budget: float, most the 15 players can cost, in the units of `value`
+    - presolve: bool, drop players that can never improve the selection before solving
+    - solver: pulp solver, defaults to pulp's default solver
+
+    Returns:
+    Tuple of lists with the index labels of the starting 11 and of the substitutes.
+    """
+    position_codes = _codes(data, 'position', [f'position_{position}' for position in schema.POSITIONS], schema.POSITIONS)
+    team_codes = _codes(data, 'team', [col for col in data.columns if col.startswith('team_') and col not in TEAM_STAT_COLUMNS])
+
+    starting_11, substitutes = solve_selection(data['xP'].to_numpy(), data['value'].to_numpy(), position_codes,
+                                               team_codes, budget, presolve, solver)
+    return data.index[starting_11].tolist(), data.index[substitutes].tolist()
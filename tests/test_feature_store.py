@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import fetch_data
+import clean_data
+import schema
+from feature_store import compare_with_full_recompute
+from benchmarks import synthetic
+
+
+@pytest.fixture(scope='module')
+def compact_frame(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('data'))
+    seasons = synthetic.write_season_data(root, synthetic.make_season_data(n_seasons=2, n_players=120, n_gameweeks=6, seed=2))
+    fixtures = fetch_data.get_all_fixture_df(root, seasons)
+    player_data = fetch_data.get_all_player_data(fixtures, root, seasons)
+    future = fetch_data.get_future_gameweeks(player_data, fixtures, 2)
+    cleaned = clean_data.clean_player_data(pd.concat([player_data, future], ignore_index=True), fixtures)
+    return schema.compact_player_frame(cleaned, schema.team_vocabulary(fixtures))
+
+
+def test_incremental_features_match_a_full_recompute_on_the_compact_layout(compact_frame):
+    df = compact_frame
+    assert isinstance(df['name'].dtype, pd.CategoricalDtype)
+    played, future = df[df['total_points'].notna()], df[df['total_points'].isna()]
+    # Categories are sorted, the last one is the season being played
+    in_season = played['season'] == played['season'].cat.categories[-1]
+    last = in_season & (played['gameweek'] == played.loc[in_season, 'gameweek'].max())
+
+    differences = compare_with_full_recompute(played[~last], played[last], future)
+    assert differences
+    # The compact layout stores stats as float32, so the full recompute rounds to float32 precision
+    assert max(differences.values()) < 1e-5
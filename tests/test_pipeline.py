@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import fetch_data
+import clean_data
+import pipeline
+from feature_matrix import feature_matrix
+from benchmarks import synthetic
+
+
+@pytest.fixture(scope='module')
+def data_root(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp('data'))
+    seasons = synthetic.write_season_data(root, synthetic.make_season_data(n_seasons=2, n_players=150, n_gameweeks=8, seed=1))
+    return root, seasons
+
+
+def test_model_inputs_match_between_labelled_and_future_rows(data_root):
+    root, seasons = data_root
+    fixtures = fetch_data.get_all_fixture_df(root, seasons)
+    player_data = pipeline._player_data(fixtures, root, seasons, num_gameweeks=2)
+    features = pipeline._features(clean_data.clean_player_data(player_data, fixtures), fixtures)
+    _, X, y, _, X_future = pipeline.model_inputs(features)
+
+    assert list(X.columns) == list(X_future.columns)
+    assert len(X) and len(X_future) and not np.isnan(y).any()
+    # A column that is never zero when labelled but always zero when predicting is a stat of the game itself
+    only_zero_in_future = [col for col in X.columns if (X[col] != 0).any() and (X_future[col] == 0).all()]
+    assert only_zero_in_future == []
+
+
+def test_changing_the_budget_only_reruns_select_team(data_root, tmp_path):
+    root, seasons = data_root
+    run = pipeline.pipeline(pipeline.default_stages(), str(tmp_path / 'cache'))
+    params = {'data_root': root, 'seasons': seasons, 'gw_cache_dir': str(tmp_path / 'gws'),
+              'resolver_file': str(tmp_path / 'resolver.json'), 'matrix_dir': str(tmp_path / 'matrices'),
+              'model_params': {'n_estimators': 5}, 'budget': 1000}
+    run.run(params)
+    run.run(params)
+    assert all(stage['status'] == 'cached' for stage in run.report)
+
+    run.run({**params, 'budget': 950})
+    assert [stage['stage'] for stage in run.report if stage['status'] == 'ran'] == ['select_team']
+
+
+def test_model_is_searched_and_trained_on_the_feature_matrix(data_root, tmp_path):
+    root, seasons = data_root
+    run = pipeline.pipeline(pipeline.default_stages(), str(tmp_path / 'cache'))
+    params = {'data_root': root, 'seasons': seasons, 'resolver_file': str(tmp_path / 'resolver.json'),
+              'matrix_dir': str(tmp_path / 'matrices'), 'search_grid': {'n_estimators': [3, 4], 'max_depth': [4]},
+              'model_params': {'random_state': 0}}
+    outputs = run.run(params, targets=['feature_matrix', 'features', 'search', 'model'])
+
+    fm = feature_matrix(outputs['feature_matrix'])
+    _, X, _, _, X_future = pipeline.model_inputs(outputs['features'])
+    assert fm.columns == list(X.columns) == list(X_future.columns)
+    assert len(fm.y[fm.labelled]) == len(X)
+    assert outputs['search'] in [{'n_estimators': 3, 'max_depth': 4}, {'n_estimators': 4, 'max_depth': 4}]
+    assert outputs['model'].model.n_estimators == outputs['search']['n_estimators']
+    assert outputs['model'].model.n_features_in_ == len(fm.columns)
+
+
+def test_select_team_sums_double_gameweeks_and_skips_blanks():
+    rows = [(f'{position}{i}', position_code, 10 * position_code + i, 1.0 + i, 1)
+            for position_code, (position, count) in enumerate([('GK', 3), ('DEF', 6), ('MID', 6), ('FWD', 4)])
+            for i in range(count)]
+    predictions = pd.DataFrame(rows, columns=['name', 'position_code', 'team_code', 'xP', 'fixture'])
+    predictions = pd.concat([
+        predictions,
+        # A double gameweek, worth the two fixtures together, and a blank gameweek without a fixture
+        pd.DataFrame({'name': ['Double', 'Double', 'Blank'], 'position_code': [3, 3, 3], 'team_code': [50, 50, 51],
+                      'xP': [4.0, 4.0, 20.0], 'fixture': [1, 2, np.nan]}),
+    ], ignore_index=True).assign(gameweek=5, value=50)
+    later = predictions.assign(gameweek=6, xP=100.0)
+
+    team = pipeline._select_team(pd.concat([predictions, later], ignore_index=True), budget=1000)
+
+    assert len(team) == 15 and team['name'].is_unique
+    assert team.loc[team['name'] == 'Double', 'xP'].tolist() == [8.0]
+    assert 'Blank' not in set(team['name'])
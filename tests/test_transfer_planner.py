@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from transfer_planner import transfer_planner, _dominated
+
+
+def _horizon(gameweeks=(1, 2)):
+    """A squad of weak players from different teams and four cheap, strong forwards of one team."""
+    squad = [(f'{position}{i}', position, f'T{position}{i}', 50, 1.0)
+             for position, count in [('GK', 2), ('DEF', 5), ('MID', 5), ('FWD', 3)] for i in range(count)]
+    strikers = [(f'S{i}', 'FWD', 'Strikers', 40, xp) for i, xp in enumerate([10.0, 9.0, 8.0, 7.0])]
+    players = pd.DataFrame(squad + strikers, columns=['name', 'position', 'team', 'value', 'xP'])
+    data = pd.concat([players.assign(gameweek=gw, fixture=gw) for gw in gameweeks], ignore_index=True)
+    return data, [name for name, *_ in squad]
+
+
+def test_presolve_keeps_the_objective():
+    data, current_squad = _horizon()
+    summaries = {}
+    for presolve in [True, False]:
+        planner = transfer_planner(hit_cost=0, max_free_transfers=5, window=None, presolve=presolve, mip_gap=0)
+        squads, summaries[presolve] = planner.plan(data, current_squad, free_transfers=5)
+    assert np.isclose(summaries[True]['xP'].sum(), summaries[False]['xP'].sum())
+    # The three best strikers of the team are all bought, only the fourth is ever dropped
+    assert set(squads.loc[squads['name'].str.startswith('S'), 'name']) == {'S0', 'S1', 'S2'}
+
+
+def test_players_are_dropped_only_past_the_team_limit():
+    xp = np.array([[10.0], [9.0], [8.0], [7.0]])
+    dominated = _dominated(xp, np.full(4, 40.0), np.full(4, 3), np.zeros(4, dtype=np.int64))
+    assert dominated.tolist() == [False, False, False, True]
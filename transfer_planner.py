@@ -0,0 +1,267 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pulp
+
+import schema
+import team_opt
+
+# Players per position in a 15 man squad
+SQUAD_SIZES = {'GK': 2, 'DEF': 5, 'MID': 5, 'FWD': 3}
+# Most transfers in one gameweek, the whole squad
+MAX_TRANSFERS = sum(SQUAD_SIZES.values())
+
+
+def horizon_arrays(data, key='name'):
+    """
+    Per player arrays of the frames from fetch_data.get_future_gameweeks with an `xP` column.
+
+    Double gameweeks add up the xP of both fixtures and blank gameweeks (no fixture, or no row)
+    count as 0.
+
+    Parameters:
+    - data: DataFrame with `key`, `gameweek`, `xP`, `value` and position and team columns, see
+        team_opt.select_team
+    - key: str, column identifying a player
+
+    Returns:
+    Dict with the player `ids`, `gameweeks`, `xp` of shape (n_players, n_gameweeks) and the
+    `value`, `position_codes` and `team_codes` of every player.
+    """
+    xp = data['xP'].where(data['fixture'].notna(), 0) if 'fixture' in data.columns else data['xP']
+    points = pd.pivot_table(data.assign(xP=xp), index=key, columns='gameweek', values='xP', aggfunc='sum',
+                            fill_value=0, observed=True)
+    players = data.sort_values('gameweek', kind='stable').drop_duplicates(key).set_index(key).loc[points.index]
+    position_columns = [f'position_{position}' for position in schema.POSITIONS]
+    team_columns = [col for col in players.columns if col.startswith('team_') and col not in team_opt.TEAM_STAT_COLUMNS]
+    return {
+        'ids': points.index.to_numpy(),
+        'gameweeks': points.columns.to_numpy(),
+        'xp': points.to_numpy(dtype=float),
+        'value': players['value'].to_numpy(dtype=float),
+        'position_codes': np.asarray(team_opt._codes(players.reset_index(), 'position', position_columns, schema.POSITIONS)),
+        'team_codes': np.asarray(team_opt._codes(players.reset_index(), 'team', team_columns)),
+    }
+
+
+def _dominated(xp, value, position_codes, team_codes):
+    """
+    Players that can be dropped without changing the best plan, the horizon version of team_opt._dominated.
+
+    Player j is dominated by i of the same position and team when i costs no more and scores at
+    least as much xP in every gameweek of the horizon (ties broken by value, total xP, then row).
+    A squad holds at most `most` players of one position and team, the position's squad size
+    capped at team_opt.MAX_PER_TEAM for players with a team. So once j has `most` dominators, one
+    of them is out of the squad in every gameweek j is in it. Putting that one in j's place, and
+    keeping it there while it stays out, keeps the position and team counts, never costs more,
+    never scores less and never needs more transfers. So some best plan never holds j. The first
+    `most` dominators of j in the ranking have fewer than `most` dominators themselves, so they are
+    kept. Players of the current squad are kept by the caller.
+
+    Returns:
+    Boolean array, True for players that can be dropped.
+    """
+    dominated = np.zeros(len(xp), dtype=bool)
+    order = np.lexsort((np.arange(len(xp)), -xp.sum(axis=1), value, team_codes, position_codes))
+    groups = np.flatnonzero(np.diff(position_codes[order]) | np.diff(team_codes[order])) + 1
+    for members in np.split(order, groups) if len(order) else []:
+        size = SQUAD_SIZES[schema.POSITIONS[position_codes[members[0]]]]
+        most = min(size, team_opt.MAX_PER_TEAM) if team_codes[members[0]] >= 0 else size
+        # dominates[j, i]: i is ranked before j (costs no more) and scores at least as much every gameweek
+        dominates = np.tri(len(members), k=-1, dtype=bool) & (xp[members][None, :, :] >= xp[members][:, None, :]).all(axis=2)
+        dominated[members[dominates.sum(axis=1) >= most]] = True
+    return dominated
+
+
+class transfer_planner():
+    def __init__(self, hit_cost=4, max_free_transfers=5, bench_weight=0.1, window=2, presolve=True, mip_gap=0.01,
+                 time_limit=None, solver=None):
+        """
+        Plans transfers, lineups and captains over the next few gameweeks.
+
+        The horizon is solved rolling forward: the squads of the next `window` gameweeks are picked
+        exactly while later gameweeks are relaxed, then the first of them is fixed and the window
+        moves on. Every solve, and the first solve of the next call to `plan`, starts from the
+        previous solution (CBC warm start), so re-planning after a gameweek is played starts from a
+        nearly optimal plan.
+
+        Parameters:
+        - hit_cost: float, points lost per transfer beyond the free ones
+        - max_free_transfers: int, most free transfers that can be banked. Each gameweek adds one free
+            transfer to the ones left unused, and taking hits leaves none unused.
+        - bench_weight: float, weight of the xP of squad players left out of the lineup
+        - window: int, gameweeks solved exactly at a time, None solves the whole horizon at once
+        - presolve: bool, drop dominated players, see _dominated, before building the problem
+        - mip_gap: float, relative gap to the best possible plan at which the solver stops, proving the
+            last fraction of a percent optimal costs far more time than it is worth with predicted xP
+        - time_limit: float, optional seconds after which the solver returns its best plan
+        - solver: pulp solver, defaults to CBC with warm starts
+        """
+        self.hit_cost = hit_cost
+        self.max_free_transfers = max_free_transfers
+        self.bench_weight = bench_weight
+        self.window = window
+        self.presolve = presolve
+        self.mip_gap = mip_gap
+        self.time_limit = time_limit
+        self.solver = solver
+        self.previous = set()
+        self.previous_gameweeks = set()
+
+    def _solver(self, warm_start):
+        if self.solver is not None:
+            return self.solver
+        return pulp.PULP_CBC_CMD(msg=False, warmStart=warm_start, gapRel=self.mip_gap, timeLimit=self.time_limit)
+
+    def plan(self, data, current_squad, bank=0, free_transfers=1, key='name'):
+        """
+        Best transfers, lineup and captain for every gameweek in `data`.
+
+        Parameters:
+        - data: frames for the next gameweeks with predicted `xP`, see horizon_arrays
+        - current_squad: list of the `key` of the 15 players in the squad now
+        - bank: float, money in the bank, in the units of `value`
+        - free_transfers: int, free transfers available for the first gameweek
+        - key: str, column identifying a player
+
+        Returns:
+        Tuple of a DataFrame with one row per squad player and gameweek (with `lineup`, `captain`
+        and `bought` flags) and a DataFrame with the transfers, hits and xP of every gameweek.
+        """
+        arrays = horizon_arrays(data, key)
+        ids, gameweeks, xp = arrays['ids'], arrays['gameweeks'], arrays['xp']
+        value, position_codes, team_codes = arrays['value'], arrays['position_codes'], arrays['team_codes']
+        rows_by_id = pd.Series(np.arange(len(ids)), index=ids)
+        missing = [player for player in current_squad if player not in rows_by_id.index]
+        if missing:
+            raise ValueError(f'Players {missing} of the current squad have no rows in the data.')
+        current = rows_by_id[list(current_squad)].to_numpy()
+        budget = bank + value[current].sum()
+
+        keep = ~_dominated(xp, value, position_codes, team_codes) if self.presolve else np.ones(len(ids), dtype=bool)
+        keep[current] = True
+        rows = np.flatnonzero(keep)
+        owned = np.isin(rows, current).astype(float)
+        n, horizon = len(rows), len(gameweeks)
+
+        prob = pulp.LpProblem('FPLTransferPlan', pulp.LpMaximize)
+        players, weeks = range(n), range(horizon)
+        # Only squad membership is binary. Once the squad is fixed the best lineup and captain are
+        # integral anyway, and each `bought` settles at 1 when the player joins the squad and 0 otherwise,
+        # so the solver only branches on the squads.
+        squad = pulp.LpVariable.dicts('squad', (players, weeks), cat='Binary')
+        lineup = pulp.LpVariable.dicts('lineup', (players, weeks), lowBound=0, upBound=1)
+        captain = pulp.LpVariable.dicts('captain', (players, weeks), lowBound=0, upBound=1)
+        bought = pulp.LpVariable.dicts('bought', (players, weeks), lowBound=0, upBound=1)
+        free = pulp.LpVariable.dicts('free_transfers', range(horizon + 1), lowBound=1, upBound=self.max_free_transfers,
+                                     cat='Integer')
+        unused = pulp.LpVariable.dicts('unused_free_transfers', weeks, lowBound=0, upBound=self.max_free_transfers,
+                                       cat='Integer')
+        hits = pulp.LpVariable.dicts('hits', weeks, lowBound=0)
+        # took_hits[t]: more transfers than free ones, capped[t]: the banked transfers reach max_free_transfers
+        took_hits = pulp.LpVariable.dicts('took_hits', weeks, cat='Binary')
+        capped = pulp.LpVariable.dicts('capped', weeks, cat='Binary')
+
+        def total(variables, coefficients):
+            return pulp.LpAffineExpression(zip(variables, np.asarray(coefficients, dtype=float).tolist()))
+
+        objective = []
+        for t in weeks:
+            points = xp[rows, t]
+            objective.append(total([lineup[i][t] for i in players], points * (1 - self.bench_weight)))
+            objective.append(total([squad[i][t] for i in players], points * self.bench_weight))
+            objective.append(total([captain[i][t] for i in players], points))
+            objective.append(-self.hit_cost * hits[t])
+        prob += pulp.lpSum(objective)
+
+        prob += free[0] == min(max(free_transfers, 1), self.max_free_transfers)
+        order = np.argsort(team_codes[rows], kind='stable')
+        teams = [team_players for team_players in np.split(order, np.flatnonzero(np.diff(team_codes[rows][order])) + 1)
+                 if len(team_players) > team_opt.MAX_PER_TEAM and team_codes[rows[team_players[0]]] >= 0]
+        for t in weeks:
+            for position, name in enumerate(schema.POSITIONS):
+                in_position = np.flatnonzero(position_codes[rows] == position)
+                prob += pulp.lpSum(squad[i][t] for i in in_position) == SQUAD_SIZES[name]
+                fewest, most = team_opt.LINEUP_LIMITS[name]
+                prob += pulp.lpSum(lineup[i][t] for i in in_position) >= fewest
+                prob += pulp.lpSum(lineup[i][t] for i in in_position) <= most
+            prob += pulp.lpSum(lineup[i][t] for i in players) == team_opt.N_STARTERS
+            prob += pulp.lpSum(captain[i][t] for i in players) == 1
+            prob += total([squad[i][t] for i in players], value[rows]) <= budget
+            for team_players in teams:
+                prob += pulp.lpSum(squad[i][t] for i in team_players) <= team_opt.MAX_PER_TEAM
+
+            for i in players:
+                prob += lineup[i][t] <= squad[i][t]
+                prob += captain[i][t] <= lineup[i][t]
+                previous = squad[i][t - 1] if t > 0 else owned[i]
+                prob += bought[i][t] >= squad[i][t] - previous
+
+            # Transfers beyond the free ones are paid for with hits, otherwise the unused free transfers
+            #  carry over: next gameweek gets min(max_free_transfers, unused + 1)
+            transfers = pulp.lpSum(bought[i][t] for i in players)
+            prob += unused[t] == free[t] - transfers + hits[t]
+            prob += hits[t] <= MAX_TRANSFERS * took_hits[t]
+            prob += unused[t] <= self.max_free_transfers * (1 - took_hits[t])
+            prob += free[t + 1] <= unused[t] + 1
+            prob += free[t + 1] >= unused[t] + 1 - (self.max_free_transfers + 1) * capped[t]
+            prob += free[t + 1] >= self.max_free_transfers * capped[t]
+
+        # Warm start from the previous plan for the gameweeks both plans cover
+        planned_before = [t for t in weeks if gameweeks[t] in self.previous_gameweeks]
+        for i in players:
+            for t in planned_before:
+                squad[i][t].setInitialValue(float((ids[rows[i]], gameweeks[t]) in self.previous))
+
+        # Rolling horizon: only the squads of the `window` gameweeks from `first` on are binary, later ones
+        # are relaxed. The squad of `first` is then fixed and the window moves on, each solve warm
+        # started from the one before, until the window reaches the end of the horizon.
+        window = self.window or horizon
+        warm_start = bool(planned_before)
+        start = time.perf_counter()
+        for first in range(max(1, horizon - window + 1)):
+            for i in players:
+                for t in range(first, horizon):
+                    squad[i][t].cat = pulp.LpInteger if t < first + window else pulp.LpContinuous
+            prob.solve(self._solver(warm_start))
+            if pulp.LpStatus[prob.status] != 'Optimal':
+                print(f'Transfer plan for gameweek {gameweeks[first]} is {pulp.LpStatus[prob.status]}')
+            for i in players:
+                squad[i][first].lowBound = squad[i][first].upBound = round(squad[i][first].value() or 0)
+            warm_start = True
+        solve_seconds = time.perf_counter() - start
+
+        variables = {'squad': squad, 'lineup': lineup, 'captain': captain, 'bought': bought}
+        solution = {name: np.array([[table[i][t].value() or 0 for t in weeks] for i in players]) for name, table in variables.items()}
+        solution['captain'] = solution['captain'] == solution['captain'].max(axis=0)
+        solution['captain'] &= np.cumsum(solution['captain'], axis=0) == 1
+        for name in ['squad', 'lineup', 'bought']:
+            solution[name] = solution[name] > 0.5
+        self.previous = {(ids[rows[i]], gameweeks[t]) for i, t in zip(*np.nonzero(solution['squad']))}
+        self.previous_gameweeks = set(gameweeks)
+
+        squads = []
+        for t in weeks:
+            members = np.flatnonzero(solution['squad'][:, t])
+            squads.append(pd.DataFrame({
+                key: ids[rows[members]],
+                'gameweek': gameweeks[t],
+                'xP': xp[rows[members], t],
+                'value': value[rows[members]],
+                'position': np.asarray(schema.POSITIONS)[position_codes[rows[members]]],
+                'lineup': solution['lineup'][members, t],
+                'captain': solution['captain'][members, t],
+                'bought': solution['bought'][members, t],
+            }))
+        squads = pd.concat(squads, ignore_index=True)
+        summary = pd.DataFrame({
+            'gameweek': gameweeks,
+            'transfers': solution['bought'].sum(axis=0),
+            'free_transfers': [round(free[t].value()) for t in weeks],
+            'hits': [round(hits[t].value() or 0) for t in weeks],
+            'xP': [squads.loc[(squads['gameweek'] == gw) & squads['lineup'], 'xP'].sum()
+                   + squads.loc[(squads['gameweek'] == gw) & squads['captain'], 'xP'].sum() for gw in gameweeks],
+        })
+        print(f'Planned {horizon} gameweeks over {n} of {len(ids)} players in {solve_seconds:.1f}s')
+        return squads, summary
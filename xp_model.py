@@ -0,0 +1,106 @@
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import mean_squared_error, mean_absolute_error
+import joblib
+import numpy as np
+
+import schema
+import profiling
+from feature_matrix import feature_matrix
+
+
+class base_xp_model():
+    """
+    Shared surface of the xP models. Subclasses set `self.model` to a scikit-learn regressor in
+    their constructor and can override `fit` and `_matrix` to change how it is trained.
+    """
+
+    def _matrix(self, X):
+        """Matrix passed to the estimator for a feature frame or array."""
+        return schema.model_matrix(X)
+
+    @profiling.profiled
+    def fit(self, X, y, columns=None):
+        """
+        Fits the estimator on prepared model inputs.
+
+        Parameters:
+        - X: matrix of model inputs
+        - y: target values
+        - columns: list of the column names of `X`, for models that treat some columns differently
+        """
+        self.model.fit(X, y)
+
+    def train_model(self, X, y=None):
+        """
+        Trains the model.
+
+        Parameters:
+        - X: Feature DataFrame, or a feature_matrix. Either is validated on the latest 20% of its
+            labelled rows (by kickoff time for a DataFrame), a feature_matrix is trained on zero-copy views of the others.
+        - y: Target DataFrame, unused for a feature_matrix
+        """
+        if isinstance(X, feature_matrix):
+            train, valid = X.holdout(0.2)
+            columns = X.columns
+            X_train, X_valid, y_train, y_valid = X.X[train], X.X[valid], X.y[train], X.y[valid]
+        else:
+            # Time ordered so the model, and early stopping inside `fit`, is never validated on older gameweeks
+            order = X.reset_index(drop=True).sort_values('kickoff_time', kind='stable').index.to_numpy()
+            X, y = X.iloc[order], (y.iloc[order] if hasattr(y, 'iloc') else np.asarray(y)[order])
+            X_train, X_valid, y_train, y_valid = train_test_split(X, y, test_size=0.2, shuffle=False)
+            X_train = X_train.drop(columns=['name', 'kickoff_time'])
+            columns = list(X_train.columns)
+            X_train = self._matrix(X_train)
+            X_valid = self._matrix(X_valid.drop(columns=['name', 'kickoff_time']))
+        self.fit(X_train, y_train, columns)
+
+        predictions = self.model.predict(X_valid)
+        mse = mean_squared_error(y_valid, predictions)
+        mae = mean_absolute_error(y_valid, predictions)
+
+        print(f'Mean Squared Error: {mse}')
+        print(f'Mean Absolute Error: {mae}')
+
+    @profiling.profiled
+    def predict(self, X):
+        """
+        Get model's predictions given input data.
+
+        Parameters:
+        - X: Input data DataFrame, array, or feature_matrix (every row is scored)
+
+        Returns:
+        Numpy array of predictions.
+        """
+        if isinstance(X, feature_matrix):
+            X = X.X
+        return self.model.predict(self._matrix(X))
+
+    def save_model(self, file_name):
+        """
+        Saves the model to a file.
+
+        Parameters:
+        - file_name: str, path to save the model
+        """
+        joblib.dump(self.model, file_name)
+        print(f'Model saved as {file_name}')
+
+    def load_model(self, file_name):
+        """
+        Loads the model from a file.
+
+        Parameters:
+        - file_name: str, path to load the model from
+        """
+        self.model = joblib.load(file_name)
+        print(f'Model loaded from {file_name}')
+
+    def add_predictions_to_daata(self, X):
+        """
+        Generates the predictions and adds it to the Expected points column
+            ['xP'] as the predictions
+        """
+        preds = self.predict(X)
+        X['xP'] = preds
+        return X